@@ -0,0 +1,214 @@
+
+"""
+A memory efficient variant of the Plan for large beds and populations.
+"""
+
+import random
+import typing
+from array import array
+
+from .genetic_algorithm import Individual
+from .plan_optimizer import Plan, MatrixSymbiosisEvaluator, AFFECTED_TILES
+from .symbiosis_matrix import EMPTY_ID
+from ..standard_types import *
+
+
+class PlanLayout:
+    """
+    The immutable part of a plan that is shared by all CompactPlans of an optimisation: the positions of the
+    cells, the plants of the fixed cells, which cells are movable and which cells are neighbours.
+
+    The plants are interned to small ids (indices into `plants`), so that a plan only has to store the ids
+    of its movable plants.
+    """
+
+    __slots__ = ("positions", "movable_positions", "plants", "ids_by_plant", "cells", "movable_indices",
+                 "plant_counts", "non_empty_count", "neighbours")
+
+    def __init__(self, plants_by_pos: typing.Dict[Position, Plant], movable_positions: typing.Iterable[Position]):
+        self.positions: typing.Tuple[Position, ...] = tuple(plants_by_pos.keys())
+        self.movable_positions: typing.Tuple[Position, ...] = tuple(
+            pos for pos in movable_positions if pos in plants_by_pos)
+
+        self.plants: typing.Tuple[Plant, ...] = tuple(dict.fromkeys(plants_by_pos.values()))
+        self.ids_by_plant: typing.Dict[Plant, int] = {plant: i for i, plant in enumerate(self.plants)}
+
+        # Plant ids of every cell. The movable cells only contain the plants of the initial plan and
+        # are overwritten by the genome of each CompactPlan.
+        self.cells = array("H", (self.ids_by_plant[plant] for plant in plants_by_pos.values()))
+
+        indices_by_pos = {pos: i for i, pos in enumerate(self.positions)}
+        self.movable_indices: typing.Tuple[int, ...] = tuple(indices_by_pos[pos] for pos in self.movable_positions)
+
+        # How often each plant occurs in the movable cells. Every genome has exactly these plants.
+        plant_counts = [0] * len(self.plants)
+        for i in self.movable_indices:
+            plant_counts[self.cells[i]] += 1
+        self.plant_counts: typing.Tuple[int, ...] = tuple(plant_counts)
+
+        self.non_empty_count = sum(1 for plant in plants_by_pos.values() if plant is not None)
+
+        # (cell index, weight) of the neighbours of each cell in the order of AFFECTED_TILES
+        self.neighbours: typing.Tuple[typing.Tuple[typing.Tuple[int, float], ...], ...] = tuple(
+            tuple(
+                (indices_by_pos[(x + dx, y + dy)], weight)
+                for (dx, dy, weight) in AFFECTED_TILES
+                if (x + dx, y + dy) in indices_by_pos
+            )
+            for (x, y) in self.positions
+        )
+
+    @staticmethod
+    def from_plan(plan: Plan) -> "PlanLayout":
+        return PlanLayout(plan.plants_by_pos, plan.movable_positions)
+
+    def get_initial_genome(self) -> array:
+        """ Returns the plant ids of the movable cells of the initial plan. """
+        return array("H", (self.cells[i] for i in self.movable_indices))
+
+    def get_cells(self, genome: array) -> array:
+        """ Returns the plant ids of every cell with the movable cells taken from the genome. """
+        cells = array("H", self.cells)
+        for i, plant_id in zip(self.movable_indices, genome):
+            cells[i] = plant_id
+
+        return cells
+
+
+class CompactPlan (Individual):
+    """
+    A Plan that only stores the plant ids of its movable cells in a flat array (the genome). Everything else
+    is stored once in the shared PlanLayout.
+
+    It can be converted from and to a Plan and uses the same dict format in to_dict / from_dict.
+    """
+
+    __slots__ = ("layout", "genome", "fitness")
+
+    def __init__(self, layout: PlanLayout, genome: array = None):
+        self.layout = layout
+        self.genome = layout.get_initial_genome() if genome is None else genome
+        self.fitness = None
+
+    @staticmethod
+    def from_plan(plan: Plan, layout: PlanLayout = None) -> "CompactPlan":
+        """ Creates a CompactPlan from a Plan. The layout can be reused if the plan has the same cells. """
+        if layout is None:
+            return CompactPlan(PlanLayout.from_plan(plan))
+
+        genome = array("H", (layout.ids_by_plant[plan.plants_by_pos[pos]] for pos in layout.movable_positions))
+        return CompactPlan(layout, genome)
+
+    def to_plan(self) -> Plan:
+        plants = self.layout.plants
+        plants_by_pos = {pos: plants[plant_id]
+                         for pos, plant_id in zip(self.layout.positions, self.layout.get_cells(self.genome))}
+        plan = Plan(plants_by_pos, list(self.layout.movable_positions))
+        plan.fitness = self.fitness
+        return plan
+
+    @staticmethod
+    def from_dict(d: dict, layout: PlanLayout = None) -> "CompactPlan":
+        return CompactPlan.from_plan(Plan.from_dict(d), layout)
+
+    def to_dict(self):
+        return self.to_plan().to_dict()
+
+    def copy(self) -> "CompactPlan":
+        plan = CompactPlan(self.layout, array("H", self.genome))
+        plan.fitness = self.fitness
+        return plan
+
+    def randomize(self, rng: random.Random = None):
+        rng = random if rng is None else rng
+        plants = self.genome.tolist()
+        rng.shuffle(plants)
+        self.genome = array("H", plants)
+
+    def mutate(self, swap_chance=0.1, rng: random.Random = None):
+        rng = random if rng is None else rng
+        genome = self.genome
+        if len(genome) < 2:
+            return
+
+        # Pick two random plants and swap them => "Swap mutation"
+        if rng.random() <= swap_chance:
+            a, b = rng.sample(range(len(genome)), 2)
+            genome[a], genome[b] = genome[b], genome[a]
+
+    def crossover(self, other: "CompactPlan", crossover_chance=1.0, rng: random.Random = None):
+        rng = random if rng is None else rng
+        if rng.random() >= crossover_chance:
+            return self.copy()
+
+        # Same algorithm as Plan.crossover, but with a list of the remaining plant counts instead of Counters
+        remaining_counts = list(self.layout.plant_counts)
+        genome = array("H", self.genome)
+        skipped_indices = []
+
+        for i, (plant_a, plant_b) in enumerate(zip(self.genome, other.genome)):
+            if rng.random() > 0.5:
+                plant_a, plant_b = plant_b, plant_a
+
+            if remaining_counts[plant_a] > 0:
+                genome[i] = plant_a
+                remaining_counts[plant_a] -= 1
+            elif remaining_counts[plant_b] > 0:
+                genome[i] = plant_b
+                remaining_counts[plant_b] -= 1
+            else:
+                skipped_indices.append(i)
+
+        remaining_plants = (plant_id for plant_id, count in enumerate(remaining_counts) for _ in range(count))
+        for i, plant_id in zip(skipped_indices, remaining_plants):
+            genome[i] = plant_id
+
+        return CompactPlan(self.layout, genome)
+
+    def __str__(self):
+        return str(self.to_plan())
+
+
+class CompactSymbiosisEvaluator (MatrixSymbiosisEvaluator):
+    """
+    MatrixSymbiosisEvaluator that can evaluate CompactPlans (and regular Plans) with the same results.
+    """
+
+    def evaluate(self, plan: typing.Union[CompactPlan, Plan]) -> float:
+        if not isinstance(plan, CompactPlan):
+            return super().evaluate(plan)
+
+        layout = plan.layout
+        if layout.non_empty_count == 0:
+            return 0
+
+        matrix, scores = self.get_weighted_matrix()
+        get_id = matrix.get_id
+        matrix_ids = [get_id(plant) for plant in layout.plants]
+        cells = [matrix_ids[plant_id] for plant_id in layout.get_cells(plan.genome)]
+
+        total_score = 0
+        for i, plant_id in enumerate(cells):
+            if plant_id == EMPTY_ID:
+                continue
+
+            row = scores[plant_id]
+
+            plant_score = 0
+            for neighbour, weight in layout.neighbours[i]:
+                plant_score += row[cells[neighbour]] * weight
+            total_score += plant_score
+
+        total_score /= (
+            layout.non_empty_count
+            * len(AFFECTED_TILES)
+            * max(self.negative_weight, self.positive_weight))
+
+        return total_score
+
+
+COMPACT_EVALUATOR = CompactSymbiosisEvaluator(negative_weight=2)
+
+
+def evaluate_compact_fitness(plan: typing.Union[CompactPlan, Plan]) -> float:
+    return COMPACT_EVALUATOR.evaluate(plan)
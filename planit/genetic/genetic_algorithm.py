@@ -1,5 +1,14 @@
 
+import functools
+import heapq
+import math
+import multiprocessing
 import operator
+import os
+import random
+import time
+import typing
+from collections import namedtuple
 
 
 class Individual:
@@ -7,18 +16,22 @@ class Individual:
     Represents one solution in a population.
     """
 
+    # Allows subclasses to use __slots__
+    __slots__ = ()
+
     fitness: int
 
-    def randomize(self):
+    def randomize(self, rng: random.Random = None):
         """
         Initialises the individual with a random solution.
+        All stochastic operators take an optional rng that is used instead of the global random module.
         """
         pass
 
-    def mutate(self):
+    def mutate(self, rng: random.Random = None):
         pass
 
-    def crossover(self, other) -> "Individual":
+    def crossover(self, other, rng: random.Random = None) -> "Individual":
         pass
 
     def __repr__(self):
@@ -37,35 +50,66 @@ class Selection:
     """
 
     @staticmethod
-    def tournament(population: list, offspring_count: int, contenders_per_round: int = 2):
-        contenders = set(population)
+    def tournament(population: list, offspring_count: int, contenders_per_round: int = 2,
+                   rng: random.Random = None):
+        """
+        Each parent is the fittest of contenders_per_round randomly chosen individuals. An individual can only
+        be chosen as a parent once, while the losers of a round compete again in later rounds.
+        """
+        rng = random if rng is None else rng
+        fitness_values = [individual.fitness for individual in population]
+
+        # Indices of the individuals that haven't won a round yet. Winners are removed by swapping them
+        # with the last index, which keeps every round O(contenders_per_round).
+        available = list(range(len(population)))
         winner_pairs = []
 
         for _ in range(offspring_count):
             pair = []
 
             for _ in range(2):
-                round_contenders = set(contenders.pop() for _ in range(contenders_per_round))
-                winner = max(round_contenders, key=operator.attrgetter("fitness"))
-                round_contenders.remove(winner)
-                contenders.update(round_contenders)
+                round_contenders = rng.sample(range(len(available)), min(contenders_per_round, len(available)))
+                winner = max(round_contenders, key=lambda i: fitness_values[available[i]])
 
-                pair.append(winner)
+                pair.append(population[available[winner]])
+                available[winner] = available[-1]
+                available.pop()
 
             winner_pairs.append(pair)
 
         return winner_pairs
 
     @staticmethod
-    def fittest(population: list, offspring_count: int):
-        population.sort(reverse=True, key=operator.attrgetter("fitness"))
-        parents_a = population[:offspring_count*2:2]
-        parents_b = population[1:offspring_count*2:2]
-        pairs = [(a, b) for a, b in zip(parents_a, parents_b)]
+    def fittest(population: list, offspring_count: int, rng: random.Random = None):
+        fitness_values = [individual.fitness for individual in population]
+        fittest = heapq.nlargest(offspring_count * 2, range(len(population)), key=fitness_values.__getitem__)
+
+        parents_a = fittest[::2]
+        parents_b = fittest[1::2]
+        pairs = [(population[a], population[b]) for a, b in zip(parents_a, parents_b)]
         return pairs
 
 
-# TODO: Add stall generations counter
+def _evaluate_batch(fitness_func, batch_fitness_func, individuals: list) -> list:
+    """ Returns the fitness values of a list of individuals. This can run in a worker process. """
+    if batch_fitness_func is not None:
+        return batch_fitness_func(individuals)
+
+    return [fitness_func(individual) for individual in individuals]
+
+
+GenerationStats = namedtuple("GenerationStats", ("generation", "best_fitness", "mean_fitness"))
+
+
+def _should_stop(stall_generations, best_fitness, max_stall_generations=None, target_fitness=None) -> bool:
+    """ Decides whether an evolution has converged based on the optional stop criteria. """
+    if max_stall_generations is not None and stall_generations >= max_stall_generations:
+        return True
+
+    if target_fitness is not None and best_fitness >= target_fitness:
+        return True
+
+    return False
 
 
 class Evolution:
@@ -81,7 +125,31 @@ class Evolution:
             mutate_params={},
             crossover_params={},
 
-            selection_method=Selection.tournament):
+            selection_method=Selection.tournament,
+
+            batch_fitness_func=None,
+
+            executor=None,
+            batch_size=None,
+
+            rng: random.Random = None,
+
+            initial_individuals=()):
+        """
+        The fitness of an individual is computed by fitness_func. When a batch_fitness_func is given, it is used
+        instead and has to return the fitness values of a whole list of individuals at once (in the same order).
+
+        An executor (from concurrent.futures) can be passed to evaluate the individuals in parallel. They are
+        then split into batches of batch_size individuals and each batch is evaluated by one worker. By default,
+        the individuals are split evenly, so that every worker gets a batch. With a process pool, the fitness
+        functions have to be picklable, e.g. module level functions.
+
+        Every stochastic operator uses the given rng (or the global random module). With a seeded
+        random.Random, the evolution is reproducible.
+
+        The initial_individuals (e.g. the result of a previous run) replace some of the random individuals
+        of the initial population.
+        """
 
         assert offspring_count <= size/2
 
@@ -89,6 +157,10 @@ class Evolution:
         self.size = 0
         self.offspring_count = offspring_count
         self.fitness_func = fitness_func
+        self.batch_fitness_func = batch_fitness_func
+
+        self.executor = executor
+        self.batch_size = batch_size
 
         self.init_params = init_params
         self.randomize_params = randomize_params
@@ -96,48 +168,344 @@ class Evolution:
         self.crossover_params = crossover_params
 
         self.selection_method = selection_method
+        self.rng = random if rng is None else rng
 
         self.population = []
-        for i in range(size):
-            self._add_random_individual()
-
-    def _add_random_individual(self):
+        self._add_random_individuals(size)
+
+        if len(initial_individuals) > 0:
+            initial_individuals = list(initial_individuals)
+            self._evaluate(initial_individuals)
+            self.add_individuals(initial_individuals)
+
+        # Best and mean fitness of every generation (starting with the random initial population) and
+        # the number of generations since the best fitness last improved
+        self.generation = 0
+        self.history: typing.List[GenerationStats] = []
+        self.stall_generations = 0
+        self._record_generation()
+
+    def _get_batch_size(self, individual_count: int) -> int:
+        if self.batch_size is not None:
+            return self.batch_size
+
+        # ProcessPoolExecutor and ThreadPoolExecutor don't expose their number of workers publicly
+        worker_count = getattr(self.executor, "_max_workers", None) or os.cpu_count() or 1
+        return max(1, math.ceil(individual_count / worker_count))
+
+    def _evaluate(self, individuals: list):
+        """ Computes and sets the fitness of every given individual. """
+        batch_size = self._get_batch_size(len(individuals))
+
+        # A single batch would only add the cost of sending the individuals to a worker
+        if self.executor is not None and len(individuals) > batch_size:
+            batches = [individuals[i:i+batch_size] for i in range(0, len(individuals), batch_size)]
+            batch_func = functools.partial(_evaluate_batch, self.fitness_func, self.batch_fitness_func)
+            fitness_values = [
+                fitness
+                for batch_fitness_values in self.executor.map(batch_func, batches)
+                for fitness in batch_fitness_values
+            ]
+        else:
+            fitness_values = _evaluate_batch(self.fitness_func, self.batch_fitness_func, individuals)
+
+        for individual, fitness in zip(individuals, fitness_values):
+            individual.fitness = fitness
+
+    def _add_random_individuals(self, n):
         """
-        Adds a new individual to the population that is first randomized.
+        Adds n new individuals to the population that are first randomized.
         """
-        individual = self.individual_class(**self.init_params)
-        individual.randomize(**self.randomize_params)
-        individual.fitness = self.fitness_func(individual)
-        self.population.append(individual)
+        individuals = []
+        for _ in range(n):
+            individual = self.individual_class(**self.init_params)
+            individual.randomize(**self.randomize_params, rng=self.rng)
+            individuals.append(individual)
 
-    def _sort_population(self):
-        """ Sorts the population based on the fitness scores from low to high. """
-        self.population = sorted(self.population, key=operator.attrgetter("fitness"))
+        self._evaluate(individuals)
+        self.population.extend(individuals)
 
     def _kill_weakest(self, n):
         """ Removes the weakest n individuals from the population. """
-        self._sort_population()
-        del self.population[:n]
+        if n <= 0:
+            return
+
+        # Only the n weakest have to be found, which is a lot cheaper than sorting the entire population
+        fitness_values = [individual.fitness for individual in self.population]
+        weakest = set(heapq.nsmallest(n, range(len(self.population)), key=fitness_values.__getitem__))
+        self.population = [individual for i, individual in enumerate(self.population) if i not in weakest]
+
+    def _record_generation(self):
+        """ Adds the fitness stats of the current population to the history and updates the stall counter. """
+        best_fitness = max(individual.fitness for individual in self.population)
+        mean_fitness = sum(individual.fitness for individual in self.population) / len(self.population)
+
+        if len(self.history) > 0 and best_fitness <= self.history[-1].best_fitness:
+            self.stall_generations += 1
+        else:
+            self.stall_generations = 0
+
+        self.history.append(GenerationStats(self.generation, best_fitness, mean_fitness))
 
     def evolve(self):
-        parent_pairs = self.selection_method(self.population, self.offspring_count)
+        parent_pairs = self.selection_method(self.population, self.offspring_count, rng=self.rng)
 
         offsprings = []
         for (a, b) in parent_pairs:
-            offspring = a.crossover(b, **self.crossover_params)
-            offspring.mutate(**self.mutate_params)
-            offspring.fitness = self.fitness_func(offspring)
-
+            offspring = a.crossover(b, **self.crossover_params, rng=self.rng)
+            offspring.mutate(**self.mutate_params, rng=self.rng)
             offsprings.append(offspring)
 
+        self._evaluate(offsprings)
         self.population.extend(offsprings)
         self._kill_weakest(len(offsprings))
 
+        self.generation += 1
+        self._record_generation()
+
+    def has_converged(self, max_stall_generations=None, target_fitness=None) -> bool:
+        """
+        Returns true when the best fitness hasn't improved for max_stall_generations generations or when it
+        has reached the target fitness.
+        """
+        return _should_stop(self.stall_generations, self.history[-1].best_fitness,
+                            max_stall_generations, target_fitness)
+
+    def run(self, max_generations, max_stall_generations=None, target_fitness=None, time_limit=None,
+            callback=None) -> int:
+        """
+        Evolves the population until max_generations generations have passed, it has converged (see has_converged)
+        or the time limit (in seconds) is exceeded. The optional callback is called with the Evolution after each
+        generation. If it returns True, the evolution stops (e.g. when the user cancels it).
+
+        Returns the number of generations that were run.
+        """
+        start_time = time.perf_counter()
+
+        for i in range(max_generations):
+            if self.has_converged(max_stall_generations, target_fitness):
+                return i
+
+            if time_limit is not None and time.perf_counter() - start_time >= time_limit:
+                return i
+
+            self.evolve()
+
+            if callback is not None and callback(self):
+                return i + 1
+
+        return max_generations
+
+    def add_individuals(self, individuals: list):
+        """
+        Adds individuals that already have a fitness (e.g. migrants from another population) and removes
+        the same number of the weakest individuals.
+        """
+        self.population.extend(individuals)
+        self._kill_weakest(len(individuals))
+
     def get_best(self):
         """ Returns the individual with the highest fitness. """
         return self.get_best_n(1)[0]
 
     def get_best_n(self, n):
-        """ Returns the n best individuals with the highest fitness values. """
-        self._sort_population()
-        return self.population[len(self.population) - n:]
+        """ Returns the n best individuals with the highest fitness values, from low to high fitness. """
+        best = heapq.nlargest(n, self.population, key=operator.attrgetter("fitness"))
+        best.reverse()
+        return best
+
+
+class Topology:
+    """
+    Different migration topologies that define to which other islands each island of an IslandModel sends
+    its best individuals.
+    """
+
+    @staticmethod
+    def ring(island_count: int) -> typing.List[typing.List[int]]:
+        if island_count < 2:
+            return [[] for _ in range(island_count)]
+
+        return [[(i + 1) % island_count] for i in range(island_count)]
+
+    @staticmethod
+    def fully_connected(island_count: int) -> typing.List[typing.List[int]]:
+        return [[j for j in range(island_count) if j != i] for i in range(island_count)]
+
+
+def _run_island(connection, evolution_params: dict, migrant_count: int, seed, initializer, initargs):
+    """
+    Runs one island of an IslandModel in a worker process.
+    It waits for commands from the IslandModel and answers each epoch (and the initial "best" command) with
+    its best individuals.
+    """
+    if initializer is not None:
+        initializer(*initargs)
+
+    # Every island needs its own rng. Otherwise, forked processes would inherit the random state of the
+    # parent and every island would evolve exactly the same population. A seed of None uses system entropy.
+    evolution = Evolution(**evolution_params, rng=random.Random(seed))
+
+    while True:
+        command, params = connection.recv()
+
+        if command == "stop":
+            break
+
+        if command == "best":
+            connection.send(evolution.get_best_n(migrant_count))
+
+        if command == "evolve":
+            generations, migrants = params
+            if len(migrants) > 0:
+                evolution.add_individuals(migrants)
+
+            for _ in range(generations):
+                evolution.evolve()
+
+            connection.send(evolution.get_best_n(migrant_count))
+
+    connection.close()
+
+
+class IslandModel:
+    """
+    Runs several independent Evolutions ("islands") in separate processes.
+
+    After each epoch of migration_interval generations, every island sends copies of its migrant_count best
+    individuals to the islands it is connected to by the topology. There, they replace the weakest individuals
+    at the start of the next epoch. The islands only synchronise once per epoch.
+
+    The evolution_params are passed to the Evolution of each island and, like the optional initializer that is
+    called in each process before, have to be picklable.
+    With a seed, every island gets its own seed derived from it, which makes the whole run reproducible.
+    """
+
+    def __init__(
+            self,
+            island_count: int,
+            evolution_params: dict,
+            migration_interval=10,
+            migrant_count=2,
+            topology=Topology.ring,
+            initializer=None,
+            initargs=(),
+            seed=None):
+
+        self.island_count = island_count
+        self.migration_interval = migration_interval
+        self.migrant_count = migrant_count
+        self.neighbours_by_island = topology(island_count)
+
+        self._connections = []
+        self._processes = []
+
+        if seed is None:
+            island_seeds = [None] * island_count
+        else:
+            seed_rng = random.Random(seed)
+            island_seeds = [seed_rng.getrandbits(64) for _ in range(island_count)]
+
+        for island_seed in island_seeds:
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_run_island,
+                args=(worker_connection, evolution_params, migrant_count, island_seed, initializer, initargs),
+                daemon=True)
+            process.start()
+
+            self._connections.append(connection)
+            self._processes.append(process)
+
+        # The best individuals of each island after the last epoch. Until the first epoch, the ones of the
+        # initial populations, so that there is a best individual even if no epoch runs.
+        for connection in self._connections:
+            connection.send(("best", None))
+        self.best_by_island: typing.List[list] = [connection.recv() for connection in self._connections]
+
+        # Same as in Evolution, but across all islands and only updated after each epoch
+        self.generation = 0
+        self.history: typing.List[GenerationStats] = []
+        self.stall_generations = 0
+
+    def evolve(self, generations=None):
+        """
+        Runs one epoch: Every island evolves for the given number of generations (by default the migration
+        interval) in parallel and then the best individuals migrate.
+        """
+        if generations is None:
+            generations = self.migration_interval
+
+        migrants_by_island = [[] for _ in range(self.island_count)]
+        for island, neighbours in enumerate(self.neighbours_by_island):
+            for neighbour in neighbours:
+                migrants_by_island[neighbour].extend(self.best_by_island[island])
+
+        for connection, migrants in zip(self._connections, migrants_by_island):
+            connection.send(("evolve", (generations, migrants)))
+
+        self.best_by_island = [connection.recv() for connection in self._connections]
+        self.generation += generations
+
+        # The islands only report their best individuals, so the mean is the one of those
+        best_individuals = [individual for best in self.best_by_island for individual in best]
+        best_fitness = max(individual.fitness for individual in best_individuals)
+        mean_fitness = sum(individual.fitness for individual in best_individuals) / len(best_individuals)
+
+        if len(self.history) > 0 and best_fitness <= self.history[-1].best_fitness:
+            self.stall_generations += generations
+        else:
+            self.stall_generations = 0
+
+        self.history.append(GenerationStats(self.generation, best_fitness, mean_fitness))
+
+    def run(self, max_generations, max_stall_generations=None, target_fitness=None, time_limit=None,
+            callback=None) -> int:
+        """
+        Same as Evolution.run, but the stop criteria are only checked after each epoch and the callback is
+        called with the IslandModel after each epoch. If it returns True, the evolution stops.
+        """
+        start_time = time.perf_counter()
+
+        while self.generation < max_generations:
+            if len(self.history) > 0 and _should_stop(self.stall_generations, self.history[-1].best_fitness,
+                                                      max_stall_generations, target_fitness):
+                break
+
+            if time_limit is not None and time.perf_counter() - start_time >= time_limit:
+                break
+
+            self.evolve(min(self.migration_interval, max_generations - self.generation))
+
+            if callback is not None and callback(self):
+                break
+
+        return self.generation
+
+    def get_best(self):
+        """ Returns the individual with the highest fitness across all islands. """
+        return self.get_best_n(1)[0]
+
+    def get_best_n(self, n):
+        """ Returns the n best individuals across all islands, from low to high fitness. """
+        individuals = [individual for best in self.best_by_island for individual in best]
+        individuals.sort(key=operator.attrgetter("fitness"))
+        return individuals[len(individuals) - n:]
+
+    def close(self):
+        """ Stops the island processes. """
+        for connection in self._connections:
+            connection.send(("stop", None))
+            connection.close()
+
+        for process in self._processes:
+            process.join()
+
+        self._connections.clear()
+        self._processes.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,12 +1,15 @@
 
 import random
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-from .genetic_algorithm import Evolution, Individual
+from .genetic_algorithm import Evolution, Individual, IslandModel, Topology
+from .symbiosis_matrix import SymbiosisMatrix, EMPTY_ID, get_shared_matrix, set_shared_matrix
+from .result_cache import ResultCache, CanonicalPlan
 import planit.plant_data as plant_data
 
 from tabulate import tabulate
-from tqdm import trange
+from tqdm import tqdm
 
 import typing
 from ..standard_types import *
@@ -17,6 +20,37 @@ class Plan (Individual):
         self.movable_positions = movable_positions
         self.plants_by_pos = dict(plants_by_pos)
 
+        self._fitness = None
+        self._non_empty_count = None
+
+        # Swaps that were made since the fitness was last set. They let an evaluator update the
+        # previous fitness instead of evaluating the entire plan again.
+        self.swaps: typing.List[typing.Tuple[Position, Position]] = []
+
+    @property
+    def fitness(self):
+        return self._fitness
+
+    @fitness.setter
+    def fitness(self, fitness):
+        self._fitness = fitness
+        self.swaps.clear()
+
+    @property
+    def non_empty_count(self) -> int:
+        """ The number of cells that have a plant. Plans only move plants around, so this is only computed once. """
+        if self._non_empty_count is None:
+            self._non_empty_count = sum(1 for plant in self.plants_by_pos.values() if plant is not None)
+
+        return self._non_empty_count
+
+    def copy(self) -> "Plan":
+        """ Returns a copy of the plan that keeps the fitness of this plan. """
+        plan = Plan(self.plants_by_pos, list(self.movable_positions))
+        plan.fitness = self.fitness
+        plan._non_empty_count = self._non_empty_count
+        return plan
+
     @staticmethod
     def from_dict(d: dict):
         plants_by_pos = {}
@@ -32,24 +66,36 @@ class Plan (Individual):
             "movable_positions": self.movable_positions
         }
 
-    def randomize(self):
+    def randomize(self, rng: random.Random = None):
+        rng = random if rng is None else rng
         plants = list(self.plants_by_pos[pos] for pos in self.movable_positions)
-        random.shuffle(plants)
+        rng.shuffle(plants)
 
         for pos in self.movable_positions:
             self.plants_by_pos[pos] = plants.pop()
 
-    def mutate(self, swap_chance=0.1):
+        # The plants weren't moved by swaps, so the fitness has to be evaluated again
+        self.fitness = None
+
+    def mutate(self, swap_chance=0.1, rng: random.Random = None):
+        rng = random if rng is None else rng
         if len(self.movable_positions) < 2:
             return
 
         # Pick two random plants and swap them => "Swap mutation"
-        if random.random() <= swap_chance:
-            a, b = random.sample(self.movable_positions, 2)
+        if rng.random() <= swap_chance:
+            a, b = rng.sample(self.movable_positions, 2)
             plants = self.plants_by_pos
             plants[a], plants[b] = plants[b], plants[a]
+            self.swaps.append((a, b))
+
+    def crossover(self, other: "Plan", crossover_chance=1.0, rng: random.Random = None):
+        rng = random if rng is None else rng
+        # Without a crossover the offspring is a copy of this plan, so its fitness only has to be updated
+        # for the swaps of the following mutation.
+        if rng.random() >= crossover_chance:
+            return self.copy()
 
-    def crossover(self, other: "Plan"):
         movable_positions = set(self.movable_positions)
 
         total_plant_counts = Counter(self.plants_by_pos[pos] for pos in movable_positions)
@@ -69,8 +115,9 @@ class Plan (Individual):
         # 1. Randomly try to copy one plant from one of the two parent plans to the offspring.
         # Sometimes this isn't possible because the offspring already has so many plants of that type that
         # adding another one would exceed the original plant count.
-        for pos in movable_positions:
-            donor_a, donor_b = (self, other) if random.random() > 0.5 else (other, self)
+        # Iterate over the list instead of the set, so that a seeded rng always gives the same offspring
+        for pos in self.movable_positions:
+            donor_a, donor_b = (self, other) if rng.random() > 0.5 else (other, self)
 
             if try_insert(pos, donor_a.plants_by_pos[pos]):
                 continue
@@ -96,7 +143,9 @@ class Plan (Individual):
         for pos in non_movable_positions:
             offspring_plants[pos] = self.plants_by_pos[pos]
 
-        return Plan(offspring_plants, list(self.movable_positions))
+        offspring = Plan(offspring_plants, list(self.movable_positions))
+        offspring._non_empty_count = self._non_empty_count
+        return offspring
 
     def __str__(self):
         if len(self.plants_by_pos) == 0:
@@ -184,13 +233,98 @@ class SymbiosisEvaluator (Evaluator):
         symbiosis_score *= influence_weight
         return symbiosis_score
 
+    def _get_score_func(self) -> typing.Callable[[Plant, Plant, float], float]:
+        """
+        Returns a function like get_modified_symbiosis_score. It is fetched once per evaluation, so that
+        subclasses can look up their data once instead of for every pair of neighbours.
+        """
+        return self.get_modified_symbiosis_score
+
     def evaluate_cell(self, plan, pos):
+        get_score = self._get_score_func()
         plant = plan.plants_by_pos[pos]
-        score = sum(self.get_modified_symbiosis_score(plant, neighbour, weight)
+        score = sum(get_score(plant, neighbour, weight)
                     for neighbour, weight in get_neighbours(plan, pos))
         score /= len(AFFECTED_TILES) * max(self.negative_weight, self.positive_weight)
         return score
 
+    def _get_local_score(self, plan: Plan, positions: typing.Sequence[Position],
+                         get_score: typing.Callable[[Plant, Plant, float], float]) -> float:
+        """
+        Returns the unnormalised part of the total score that depends on the plants at the given positions:
+        Their own scores and their share in the scores of their neighbours.
+        """
+        score = 0
+        counted_positions = set()
+
+        for pos in positions:
+            if pos in counted_positions:
+                continue
+            counted_positions.add(pos)
+
+            plant = plan.plants_by_pos.get(pos, None)
+            if plant is None:
+                continue
+
+            for (dx, dy, weight) in AFFECTED_TILES:
+                neighbour_pos = (pos[0] + dx, pos[1] + dy)
+                neighbour = plan.plants_by_pos.get(neighbour_pos, None)
+
+                # Pairs within the positions were already counted from the other side
+                if neighbour is None or neighbour_pos in counted_positions:
+                    continue
+
+                # The plant scores with its neighbour, and the neighbour scores with the plant
+                score += get_score(plant, neighbour, weight)
+                score += get_score(neighbour, plant, weight)
+
+        return score
+
+    def evaluate_swap(self, plan: Plan, pos_a: Position, pos_b: Position) -> float:
+        """
+        Returns by how much the fitness of the plan changes when the plants at pos_a and pos_b are swapped.
+
+        Only the two cells and their neighbours are taken into account, so this is O(1) instead of O(cells).
+        The plan is left unchanged.
+        """
+        if plan.non_empty_count == 0:
+            return 0
+
+        plants = plan.plants_by_pos
+        positions = (pos_a, pos_b)
+        get_score = self._get_score_func()
+
+        score_before = self._get_local_score(plan, positions, get_score)
+        plants[pos_a], plants[pos_b] = plants[pos_b], plants[pos_a]
+        score_after = self._get_local_score(plan, positions, get_score)
+        plants[pos_a], plants[pos_b] = plants[pos_b], plants[pos_a]
+
+        return (score_after - score_before) / (
+            plan.non_empty_count
+            * len(AFFECTED_TILES)
+            * max(self.negative_weight, self.positive_weight))
+
+    def evaluate_swaps(self, plan: Plan) -> float:
+        """
+        Computes the fitness of a plan from its previous fitness and the swaps that were made since then.
+        """
+        plants = plan.plants_by_pos
+
+        # The plan already contains the swaps => Undo them and then redo them one after another
+        for (a, b) in reversed(plan.swaps):
+            plants[a], plants[b] = plants[b], plants[a]
+
+        fitness = plan.fitness
+        for (a, b) in plan.swaps:
+            fitness += self.evaluate_swap(plan, a, b)
+            plants[a], plants[b] = plants[b], plants[a]
+
+        return fitness
+
+    def can_evaluate_swaps(self, plan: Plan) -> bool:
+        # Without swaps (e.g. a copy that wasn't mutated), the previous fitness is still correct
+        return plan.fitness is not None
+
     def evaluate(self, plan: Plan) -> float:
         """
         Evaluates the total symbiosis score (fitness) of a plan.
@@ -198,8 +332,15 @@ class SymbiosisEvaluator (Evaluator):
         The formula:
         * total score = average symbiosis score of each plant
         * symbiosis score of a plant = average of the weighted symbiosis score with each neighbour
+
+        If the plan was only changed by swaps since its fitness was last set, only the swapped cells are
+        re-evaluated. An unchanged plan keeps its fitness.
         """
 
+        if self.can_evaluate_swaps(plan):
+            return self.evaluate_swaps(plan)
+
+        get_score = self._get_score_func()
         total_score = 0
         non_empty_count = 0
 
@@ -209,7 +350,7 @@ class SymbiosisEvaluator (Evaluator):
             non_empty_count += 1
 
             plant_score = sum(
-                self.get_modified_symbiosis_score(plant, neighbour, weight)
+                get_score(plant, neighbour, weight)
                 for neighbour, weight in get_neighbours(plan, pos))
             total_score += plant_score
 
@@ -224,22 +365,286 @@ class SymbiosisEvaluator (Evaluator):
         return total_score
 
 
-MAIN_EVALUATOR = SymbiosisEvaluator(negative_weight=2)
-evaluate_fitness = MAIN_EVALUATOR.evaluate
+class MatrixSymbiosisEvaluator (SymbiosisEvaluator):
+    """
+    SymbiosisEvaluator that looks up the symbiosis scores in a precomputed SymbiosisMatrix instead of querying
+    plant_data for every pair of neighbours. Unless a matrix is given, the shared matrix of the plant database
+    is used.
+    """
+
+    def __init__(self, positive_weight=1, negative_weight=1, matrix: SymbiosisMatrix = None):
+        super().__init__(positive_weight, negative_weight)
+
+        self._has_own_matrix = False
+        # The matrix and the data derived from it, e.g. its scores with the positive / negative weights already
+        # applied. The whole tuple is replaced at once, so that other threads using the same evaluator (like the
+        # optimisation worker and the UI) never see the ids of one matrix together with the scores of another.
+        self._matrix_state: typing.Optional[tuple] = None
+
+        if matrix is not None:
+            self.set_matrix(matrix)
+
+    def _get_matrix_state(self) -> tuple:
+        """ Switches to the current shared matrix unless the evaluator has its own matrix. """
+        state = self._matrix_state
+        if self._has_own_matrix:
+            return state
+
+        shared_matrix = get_shared_matrix()
+        if state is None or shared_matrix is not state[0]:
+            state = self._create_matrix_state(shared_matrix)
+            self._matrix_state = state
+
+        return state
+
+    def _create_matrix_state(self, matrix: SymbiosisMatrix) -> tuple:
+        """ Returns (matrix, weighted_scores). Subclasses can append more data that depends on the matrix. """
+        return matrix, matrix.get_weighted_scores(self.positive_weight, self.negative_weight)
+
+    def get_weighted_matrix(self) -> typing.Tuple[SymbiosisMatrix, typing.List[typing.List[int]]]:
+        """
+        Returns the matrix together with its weighted scores. Unlike reading the matrix and weighted_scores
+        properties one after another, both are guaranteed to belong to the same matrix.
+        """
+        return self._get_matrix_state()[:2]
+
+    @property
+    def matrix(self) -> SymbiosisMatrix:
+        return self._get_matrix_state()[0]
+
+    @property
+    def weighted_scores(self) -> typing.List[typing.List[int]]:
+        return self._get_matrix_state()[1]
+
+    def set_matrix(self, matrix: SymbiosisMatrix):
+        self._has_own_matrix = True
+        self._matrix_state = self._create_matrix_state(matrix)
+
+    def get_modified_symbiosis_score(self, plant, neighbour, influence_weight) -> float:
+        return self._get_score_func()(plant, neighbour, influence_weight)
+
+    def _get_score_func(self) -> typing.Callable[[Plant, Plant, float], float]:
+        matrix, scores = self.get_weighted_matrix()
+        get_id = matrix.get_id
+
+        def get_modified_symbiosis_score(plant, neighbour, influence_weight):
+            return scores[get_id(plant)][get_id(neighbour)] * influence_weight
+
+        return get_modified_symbiosis_score
+
+    def evaluate(self, plan: Plan) -> float:
+        if self.can_evaluate_swaps(plan):
+            return self.evaluate_swaps(plan)
+
+        matrix, scores = self.get_weighted_matrix()
+        get_id = matrix.ids_by_plant.get
+
+        occupied = [(pos, plant) for pos, plant in plan.plants_by_pos.items() if plant is not None]
+        if len(occupied) == 0:
+            return 0
 
+        # Lay the plant ids out in a flat grid with a border of empty cells around it, so that the neighbours
+        # of every cell are at constant offsets and need no bounds checks.
+        min_x = min(x for (x, y), plant in occupied)
+        min_y = min(y for (x, y), plant in occupied)
+        width = max(x for (x, y), plant in occupied) - min_x + 3
+        height = max(y for (x, y), plant in occupied) - min_y + 3
 
-def optimize(plan: Plan, iterations=1000) -> Plan:
-    evo = Evolution(
-        Plan,
-        50,
-        10,
-        evaluate_fitness,
-        init_params={"plants_by_pos": plan.plants_by_pos, "movable_positions": plan.movable_positions})
+        grid = [EMPTY_ID] * (width * height)
+        cells = []
 
-    for i in trange(iterations, leave=False):
-        evo.evolve()
+        for (x, y), plant in occupied:
+            idx = (x - min_x + 1) + (y - min_y + 1) * width
+            plant_id = get_id(plant, EMPTY_ID)
+            grid[idx] = plant_id
+            cells.append((idx, plant_id))
+
+        offsets = [(dx + dy * width, weight) for (dx, dy, weight) in AFFECTED_TILES]
+
+        total_score = 0
+        for idx, plant_id in cells:
+            row = scores[plant_id]
+
+            plant_score = 0
+            for offset, weight in offsets:
+                plant_score += row[grid[idx + offset]] * weight
+            total_score += plant_score
+
+        total_score /= (
+            len(cells)
+            * len(AFFECTED_TILES)
+            * max(self.negative_weight, self.positive_weight))
+
+        return total_score
+
+
+MAIN_EVALUATOR = MatrixSymbiosisEvaluator(negative_weight=2)
+
+
+def evaluate_fitness(plan: Plan) -> float:
+    # A module level function (instead of the bound method) can be sent to worker processes by reference
+    # without pickling the evaluator and its matrix every time.
+    return MAIN_EVALUATOR.evaluate(plan)
+
+
+def create_process_pool(max_workers=None) -> ProcessPoolExecutor:
+    """
+    Creates a process pool that can be used as the executor of an Evolution.
+
+    Every worker is warm-started with the symbiosis matrix once, so that it neither has to open the plant
+    database nor receive the matrix with each task.
+    """
+    return ProcessPoolExecutor(max_workers, initializer=set_shared_matrix, initargs=(get_shared_matrix(),))
+
+
+def optimize(
+        plan: Plan,
+        iterations=1000,
+        batch_fitness_func=None,
+        crossover_chance=1.0,
+        offspring_count=10,
+        executor=None,
+        batch_size=None,
+        islands=1,
+        migration_interval=10,
+        topology=Topology.ring,
+        max_stall_generations=None,
+        target_fitness=None,
+        time_limit=None,
+        compact=False,
+        seed=None,
+        cache: ResultCache = None,
+        callback: typing.Callable[[typing.Optional[Plan]], bool] = None) -> Plan:
+    """
+    Optimises the movable plants of a plan.
+
+    The optimisation runs for at most `iterations` generations. It stops early when the best fitness hasn't
+    improved for max_stall_generations generations, when it reaches the target_fitness or when the time_limit
+    (in seconds) is exceeded.
+
+    A batch_fitness_func like vectorized_evaluator.evaluate_population_fitness can be passed to evaluate
+    the offspring of each generation at once.
+    With a crossover_chance below 1, some offspring are mutated copies of their parent whose fitness is
+    updated incrementally, which is a lot cheaper on large plans.
+    Each generation creates offspring_count new plans (at most 25, half of the population).
+    The offspring can be evaluated in parallel by passing an executor, e.g. from create_process_pool(). They
+    are split into batches of batch_size plans, by default evenly among the workers.
+    With more than one island, independent populations evolve in separate processes and exchange their best
+    plans every migration_interval generations (see IslandModel). The islands already use one process each,
+    so they can't be combined with an executor.
+    With compact=True, the population consists of memory efficient CompactPlans (see compact_plan).
+    Runs with the same seed (and without a time_limit) always return the same plan.
+
+    With a ResultCache, the result of a previous run of the same plan with the same settings is returned
+    instantly. If only a few cells of the plan changed, a previous result is used as a warm start instead.
+    Results of runs with a time_limit are not cached.
+
+    The optional callback is called after each generation (or epoch of the islands) with a copy of the best
+    plan so far if it improved and with None otherwise. If it returns True, the optimisation is cancelled and
+    the best plan so far is returned without caching it.
+    """
+    if islands > 1 and executor is not None:
+        raise ValueError("The islands run in their own processes and can't use an executor")
+
+    if cache is not None:
+        canonical_plan = CanonicalPlan(plan.plants_by_pos, plan.movable_positions)
+        cache_params = dict(
+            weights=[MAIN_EVALUATOR.positive_weight, MAIN_EVALUATOR.negative_weight],
+            symbioses=get_shared_matrix().get_fingerprint(),
+            seed=seed,
+            iterations=iterations,
+            crossover_chance=crossover_chance,
+            offspring_count=offspring_count,
+            islands=islands,
+            migration_interval=migration_interval,
+            topology=topology.__name__,
+            max_stall_generations=max_stall_generations,
+            target_fitness=target_fitness,
+            compact=compact)
+
+        cached_result = cache.get(canonical_plan, cache_params)
+        if cached_result is not None:
+            plan_dict, fitness = cached_result
+            best = Plan.from_dict(plan_dict)
+            best.fitness = fitness
+            return best
+
+        warm_start = cache.find_warm_start(canonical_plan, cache_params)
+        initial_plans = [] if warm_start is None else [Plan.from_dict(warm_start)]
+    else:
+        initial_plans = []
+
+    evolution_params = dict(
+        individual_class=Plan,
+        size=50,
+        offspring_count=offspring_count,
+        fitness_func=evaluate_fitness,
+        init_params={"plants_by_pos": plan.plants_by_pos, "movable_positions": plan.movable_positions},
+        crossover_params={"crossover_chance": crossover_chance},
+        batch_fitness_func=batch_fitness_func,
+        initial_individuals=initial_plans)
+
+    if compact:
+        from .compact_plan import CompactPlan, PlanLayout, evaluate_compact_fitness
+
+        layout = PlanLayout.from_plan(plan)
+        evolution_params.update(
+            individual_class=CompactPlan,
+            fitness_func=evaluate_compact_fitness,
+            init_params={"layout": layout},
+            initial_individuals=[CompactPlan.from_plan(initial_plan, layout) for initial_plan in initial_plans])
+
+    stop_criteria = dict(
+        max_stall_generations=max_stall_generations,
+        target_fitness=target_fitness,
+        time_limit=time_limit)
+
+    best_fitness = None
+    is_cancelled = False
+
+    with tqdm(total=iterations, leave=False) as progress:
+        def update_progress(evolution):
+            nonlocal best_fitness, is_cancelled
+            progress.update(evolution.generation - progress.n)
+
+            if callback is None:
+                return False
 
-    return evo.get_best()
+            best_so_far = evolution.get_best()
+            if best_fitness is None or best_so_far.fitness > best_fitness:
+                best_fitness = best_so_far.fitness
+                is_cancelled = callback(best_so_far.to_plan() if compact else best_so_far.copy())
+            else:
+                is_cancelled = callback(None)
+
+            return is_cancelled
+
+        if islands > 1:
+            with IslandModel(
+                    islands,
+                    evolution_params,
+                    migration_interval=migration_interval,
+                    topology=topology,
+                    initializer=set_shared_matrix,
+                    initargs=(get_shared_matrix(),),
+                    seed=seed) as model:
+
+                model.run(iterations, **stop_criteria, callback=update_progress)
+                best = model.get_best()
+        else:
+            rng = None if seed is None else random.Random(seed)
+            evo = Evolution(**evolution_params, executor=executor, batch_size=batch_size, rng=rng)
+            evo.run(iterations, **stop_criteria, callback=update_progress)
+            best = evo.get_best()
+
+    if compact:
+        best = best.to_plan()
+
+    # Runs with a time_limit depend on the speed of the machine and could be cut short, so they aren't cached
+    if cache is not None and not is_cancelled and time_limit is None:
+        cache.put(canonical_plan, cache_params, best.to_dict(), best.fitness)
+
+    return best
 
 
 if __name__ == '__main__':
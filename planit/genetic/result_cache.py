@@ -0,0 +1,237 @@
+
+"""
+A persistent cache of optimisation results, so that optimising the same plan again returns instantly.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+from collections import Counter
+
+from planit import resources
+from ..standard_types import *
+
+
+# Path of the cache dir
+basePath: str = 'plantdata/'
+
+
+def _hash(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _plant_sort_key(plant: Plant):
+    return plant is None, plant or ""
+
+
+class CanonicalPlan:
+    """
+    The position independent form of a plan that is used as the cache key.
+
+    The positions are moved so that the plan starts at (0, 0). As the optimiser is free to rearrange the
+    movable plants, only their multiset is part of the key, not where they are placed.
+    """
+
+    def __init__(self, plants_by_pos: typing.Dict[Position, Plant], movable_positions: typing.Iterable[Position]):
+        self.plants_by_pos = plants_by_pos
+        self.movable_positions = set(pos for pos in movable_positions if pos in plants_by_pos)
+
+        if len(plants_by_pos) > 0:
+            self.offset = (min(x for (x, y) in plants_by_pos), min(y for (x, y) in plants_by_pos))
+        else:
+            self.offset = (0, 0)
+
+        # [x, y, is movable, plant of fixed cells]
+        self.cells = sorted(
+            [x, y, pos in self.movable_positions, None if pos in self.movable_positions else plant]
+            for pos, plant in plants_by_pos.items()
+            for x, y in [self.to_canonical(pos)])
+
+        self.movable_plants = sorted(
+            (plants_by_pos[pos] for pos in self.movable_positions), key=_plant_sort_key)
+
+        # Only the cells and whether they are movable, without any plants
+        self.geometry_key = _hash([cell[:3] for cell in self.cells])
+        self.layout = {"cells": self.cells, "movable_plants": self.movable_plants}
+
+    def to_canonical(self, pos: Position) -> Position:
+        return pos[0] - self.offset[0], pos[1] - self.offset[1]
+
+    def from_canonical(self, pos: Position) -> Position:
+        return pos[0] + self.offset[0], pos[1] + self.offset[1]
+
+    def count_changed_cells(self, layout: dict) -> int:
+        """
+        Returns in how many cells the layout of another plan with the same geometry differs from this one.
+        """
+        changed_fixed_cells = sum(1 for a, b in zip(self.cells, layout["cells"]) if a[3] != b[3])
+
+        plant_counts = Counter(self.movable_plants)
+        plant_counts.subtract(layout["movable_plants"])
+        changed_movable_cells = sum(count for count in plant_counts.values() if count > 0)
+
+        return changed_fixed_cells + changed_movable_cells
+
+    def adapt(self, plan_dict: dict) -> dict:
+        """
+        Turns a cached result of a plan with the same geometry into a valid plan for this one: The fixed cells
+        are copied from this plan and the movable cells keep the cached plants as long as this plan has enough
+        of them. The remaining movable cells are filled with the leftover plants.
+        """
+        remaining_counts = Counter(self.movable_plants)
+        plants_by_pos = {}
+        skipped_positions = []
+
+        for pos, plant in self.plants_by_pos.items():
+            if pos not in self.movable_positions:
+                plants_by_pos[pos] = plant
+
+        for x, y, plant in plan_dict["plants_by_pos"]:
+            pos = self.from_canonical((x, y))
+            if pos not in self.movable_positions:
+                continue
+
+            if remaining_counts[plant] > 0:
+                plants_by_pos[pos] = plant
+                remaining_counts[plant] -= 1
+            else:
+                skipped_positions.append(pos)
+
+        remaining_plants = (plant for plant, count in remaining_counts.items() for _ in range(count))
+        for pos, plant in zip(skipped_positions, remaining_plants):
+            plants_by_pos[pos] = plant
+
+        return {
+            "plants_by_pos": plants_by_pos,
+            "movable_positions": [self.from_canonical(pos) for pos in plan_dict["movable_positions"]]
+        }
+
+    def serialize(self, plan_dict: dict) -> str:
+        """ Converts a Plan.to_dict() of this plan to JSON in canonical positions. """
+        return json.dumps({
+            "plants_by_pos": [
+                [*self.to_canonical(pos), plant] for pos, plant in plan_dict["plants_by_pos"].items()],
+            "movable_positions": [list(self.to_canonical(pos)) for pos in plan_dict["movable_positions"]]
+        })
+
+    def deserialize(self, data: str) -> dict:
+        """ Converts the JSON of a cached plan back to a Plan.to_dict() in the positions of this plan. """
+        plan_dict = json.loads(data)
+        return {
+            "plants_by_pos": {self.from_canonical((x, y)): plant for x, y, plant in plan_dict["plants_by_pos"]},
+            "movable_positions": [self.from_canonical(pos) for pos in plan_dict["movable_positions"]]
+        }
+
+
+class ResultCache:
+    """
+    SQLite backed cache of the best plan (Plan.to_dict()) and fitness of previous optimisations.
+
+    Results are keyed by the canonical plan (see CanonicalPlan) and the params of the optimisation (e.g.
+    evaluator weights, seed, iterations). When the stored plans exceed max_size bytes, the least recently
+    used results are evicted.
+    """
+
+    def __init__(self, path: str = None, max_size: int = 16 * 1024 * 1024):
+        if path is None:
+            path = os.path.join(resources.get(basePath), 'optimisation_cache.db')
+
+        self.max_size = max_size
+
+        # The cache may be used from a background optimisation thread
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, geometry_key TEXT NOT NULL, params_key TEXT NOT NULL, '
+                'layout TEXT NOT NULL, plan TEXT NOT NULL, fitness REAL NOT NULL, '
+                'size INTEGER NOT NULL, last_used REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS results_geometry ON results (geometry_key, params_key)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+
+    @staticmethod
+    def _get_key(canonical_plan: CanonicalPlan, params_key: str) -> str:
+        return _hash([canonical_plan.layout, params_key])
+
+    def get(self, canonical_plan: CanonicalPlan, params: dict) -> typing.Optional[typing.Tuple[dict, float]]:
+        """ Returns the cached (Plan.to_dict(), fitness) of the exact same plan and params or None. """
+        key = self._get_key(canonical_plan, _hash(params))
+
+        with self._lock, self._connection:
+            row = self._connection.execute('SELECT plan, fitness FROM results WHERE key = ?', [key]).fetchone()
+            if row is None:
+                return None
+
+            self._connection.execute('UPDATE results SET last_used = ? WHERE key = ?', [time.time(), key])
+
+        return canonical_plan.deserialize(row[0]), row[1]
+
+    def find_warm_start(self, canonical_plan: CanonicalPlan, params: dict, max_changed_cells: int = 5) \
+            -> typing.Optional[dict]:
+        """
+        Returns the cached plan of the most similar plan with the same geometry and params that differs in
+        at most max_changed_cells cells, adapted to the given plan. It can be used to seed the optimisation.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT layout, plan FROM results WHERE geometry_key = ? AND params_key = ?',
+                [canonical_plan.geometry_key, _hash(params)]).fetchall()
+
+        best_row, best_changed_cells = None, None
+        for row in rows:
+            changed_cells = canonical_plan.count_changed_cells(json.loads(row[0]))
+            if changed_cells > max_changed_cells:
+                continue
+
+            if best_row is None or changed_cells < best_changed_cells:
+                best_row, best_changed_cells = row, changed_cells
+
+        if best_row is None:
+            return None
+
+        return canonical_plan.adapt(json.loads(best_row[1]))
+
+    def put(self, canonical_plan: CanonicalPlan, params: dict, plan_dict: dict, fitness: float):
+        """ Stores the result of an optimisation and evicts the least recently used results if necessary. """
+        params_key = _hash(params)
+        key = self._get_key(canonical_plan, params_key)
+        data = canonical_plan.serialize(plan_dict)
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [key, canonical_plan.geometry_key, params_key, json.dumps(canonical_plan.layout), data, fitness,
+                 len(data), time.time()])
+            self._evict()
+
+    def _evict(self):
+        total_size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        rows = self._connection.execute('SELECT key, size FROM results ORDER BY last_used').fetchall()
+        keys_to_delete = []
+
+        for key, size in rows:
+            if total_size <= self.max_size:
+                break
+
+            keys_to_delete.append([key])
+            total_size -= size
+
+        self._connection.executemany('DELETE FROM results WHERE key = ?', keys_to_delete)
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM results')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,122 @@
+
+"""
+A dense lookup table of the symbiosis scores between every pair of plants.
+"""
+
+import hashlib
+import json
+import typing
+
+import planit.plant_data as plant_data
+from ..standard_types import *
+
+
+# Id of empty cells (None) and of plants that have no symbioses at all. Every score with it is 0.
+EMPTY_ID = 0
+
+
+class SymbiosisMatrix:
+    """
+    Symmetric matrix of the symbiosis scores that is built once from the symbioses table.
+
+    Every plant is interned to a small integer id, so that looking up a score is a plain list access
+    (`matrix.scores[id_a][id_b]`) instead of a string keyed database query.
+    """
+
+    def __init__(self, symbioses: typing.Iterable[typing.Tuple[str, str, int]] = ()):
+        self.plants: typing.List[Plant] = [None]
+        self.ids_by_plant: typing.Dict[Plant, int] = {None: EMPTY_ID}
+
+        symbioses = list(symbioses)
+        for plant_a, plant_b, score in symbioses:
+            self._intern(plant_a)
+            self._intern(plant_b)
+
+        size = len(self.plants)
+        self.scores: typing.List[typing.List[int]] = [[0] * size for _ in range(size)]
+
+        # The db only stores one direction of each pair => Mirror it. If a pair occurs more than once,
+        # the first row wins.
+        known_pairs = set()
+        for plant_a, plant_b, score in symbioses:
+            a, b = self.ids_by_plant[plant_a], self.ids_by_plant[plant_b]
+            if (a, b) in known_pairs:
+                continue
+
+            known_pairs.add((a, b))
+            known_pairs.add((b, a))
+            self.scores[a][b] = self.scores[b][a] = score
+
+        self._fingerprint: typing.Optional[str] = None
+
+    @staticmethod
+    def from_plant_data() -> "SymbiosisMatrix":
+        """ Builds the matrix from every symbiosis score in the plant database. """
+        return SymbiosisMatrix(plant_data.get_all_symbioses())
+
+    def _intern(self, plant: Plant):
+        if plant in self.ids_by_plant:
+            return
+
+        self.ids_by_plant[plant] = len(self.plants)
+        self.plants.append(plant)
+
+    def __len__(self):
+        return len(self.plants)
+
+    def get_id(self, plant: Plant) -> int:
+        """ Returns the id of a plant. Unknown plants share the id of empty cells as they can't score anything. """
+        return self.ids_by_plant.get(plant, EMPTY_ID)
+
+    def get_symbiosis_score(self, plant_a: Plant, plant_b: Plant) -> int:
+        return self.scores[self.get_id(plant_a)][self.get_id(plant_b)]
+
+    def get_fingerprint(self) -> str:
+        """ Returns a hash of the plants and scores that changes whenever the symbiosis data changes. """
+        if self._fingerprint is None:
+            data = json.dumps([self.plants, self.scores]).encode("utf-8")
+            self._fingerprint = hashlib.sha256(data).hexdigest()
+
+        return self._fingerprint
+
+    def get_weighted_scores(self, positive_weight=1, negative_weight=1) -> typing.List[typing.List[int]]:
+        """
+        Returns a copy of the score matrix in which positive scores are multiplied by the positive weight
+        and negative scores by the negative weight.
+        """
+        return [
+            [score * (positive_weight if score > 0 else negative_weight) for score in row]
+            for row in self.scores
+        ]
+
+
+# The matrix of the plant database that is shared by every evaluator without an own matrix
+_shared_matrix: typing.Optional[SymbiosisMatrix] = None
+
+# plant_data.get_symbioses_version() of the shared matrix or None if the matrix was set explicitly
+_shared_matrix_version: typing.Optional[int] = None
+
+
+def get_shared_matrix() -> SymbiosisMatrix:
+    """
+    Returns the matrix of the plant database that is shared by the evaluators. It is built on first use and
+    rebuilt when the symbioses in the database change.
+    """
+    global _shared_matrix, _shared_matrix_version
+
+    if _shared_matrix is None or (
+            _shared_matrix_version is not None and _shared_matrix_version != plant_data.get_symbioses_version()):
+        _shared_matrix_version = plant_data.get_symbioses_version()
+        _shared_matrix = SymbiosisMatrix.from_plant_data()
+
+    return _shared_matrix
+
+
+def set_shared_matrix(matrix: SymbiosisMatrix):
+    """
+    Replaces the shared matrix. This is also used as the initializer of worker processes, so that they receive
+    the matrix once when they start instead of building it themselves.
+    """
+    global _shared_matrix, _shared_matrix_version
+    _shared_matrix = matrix
+    _shared_matrix_version = None
@@ -0,0 +1,154 @@
+
+"""
+A NumPy based fitness engine that evaluates a whole population of plans at once.
+"""
+
+import typing
+
+import numpy as np
+
+from .plan_optimizer import Plan, MatrixSymbiosisEvaluator, AFFECTED_TILES
+from .compact_plan import CompactPlan
+from .symbiosis_matrix import SymbiosisMatrix, EMPTY_ID
+from ..standard_types import *
+
+
+class VectorizedSymbiosisEvaluator (MatrixSymbiosisEvaluator):
+    """
+    Evaluator that computes the same fitness scores as the SymbiosisEvaluator, but for an entire population in
+    one pass.
+
+    The population is stored as a (pop, H, W) tensor of plant ids (see `to_grids`). For every entry in
+    AFFECTED_TILES the tensor is shifted by (dx, dy) so that all neighbour scores can be looked up in the
+    score matrix at once.
+    """
+
+    def _create_matrix_state(self, matrix: SymbiosisMatrix) -> tuple:
+        matrix, weighted_scores = super()._create_matrix_state(matrix)
+
+        # Plants that are not in the matrix get an extra id with a row and column of zeros, so that they
+        # can't be mistaken for empty cells (which don't count towards the average).
+        size = len(matrix)
+        score_table = np.zeros((size + 1, size + 1), dtype=np.float64)
+        score_table[:size, :size] = weighted_scores
+
+        return matrix, weighted_scores, score_table
+
+    @property
+    def score_table(self) -> np.ndarray:
+        return self._get_matrix_state()[2]
+
+    @property
+    def unknown_plant_id(self) -> int:
+        return len(self.matrix)
+
+    def to_grids(self, plans: typing.Sequence[typing.Union[Plan, CompactPlan]],
+                 matrix: SymbiosisMatrix = None) -> np.ndarray:
+        """
+        Converts the plans of a population to a (pop, H, W) tensor of plant ids.
+
+        Every plan has to have the same positions (which is the case for all individuals of an Evolution).
+        The grid has a border of empty cells around the bounding box of the plan and grid[i, y, x] is the
+        cell at (x + min_x - 1, y + min_y - 1). The ids are the ones of the given matrix or the current one.
+        """
+        if matrix is None:
+            matrix = self.matrix
+
+        if len(plans) == 0:
+            return np.full((0, 0, 0), EMPTY_ID, dtype=np.int32)
+
+        if isinstance(plans[0], CompactPlan):
+            positions, ids = self._get_compact_plan_ids(plans, matrix)
+        else:
+            positions, ids = self._get_plan_ids(plans, matrix)
+
+        if len(positions) == 0:
+            return np.full((len(plans), 0, 0), EMPTY_ID, dtype=np.int32)
+
+        min_x = min(x for (x, y) in positions)
+        min_y = min(y for (x, y) in positions)
+        width = max(x for (x, y) in positions) - min_x + 3
+        height = max(y for (x, y) in positions) - min_y + 3
+
+        xs = np.array([x - min_x + 1 for (x, y) in positions], dtype=np.intp)
+        ys = np.array([y - min_y + 1 for (x, y) in positions], dtype=np.intp)
+
+        grids = np.full((len(plans), height, width), EMPTY_ID, dtype=np.int32)
+        grids[:, ys, xs] = ids
+        return grids
+
+    def _get_plan_ids(self, plans: typing.Sequence[Plan], matrix: SymbiosisMatrix) \
+            -> typing.Tuple[typing.List[Position], np.ndarray]:
+        """ Returns the positions of the plans and a (pop, cells) array with the plant id of each cell. """
+        positions = list(plans[0].plants_by_pos.keys())
+
+        get_id = matrix.ids_by_plant.get
+        unknown_plant_id = len(matrix)
+
+        ids = np.array([
+            [get_id(plan.plants_by_pos[pos], unknown_plant_id) for pos in positions]
+            for plan in plans
+        ], dtype=np.int32)
+
+        return positions, ids
+
+    def _get_compact_plan_ids(self, plans: typing.Sequence[CompactPlan], matrix: SymbiosisMatrix) \
+            -> typing.Tuple[typing.List[Position], np.ndarray]:
+        """ Same as _get_plan_ids, but the genomes are copied into the cells of the shared layout at once. """
+        layout = plans[0].layout
+
+        get_id = matrix.ids_by_plant.get
+        unknown_plant_id = len(matrix)
+        matrix_ids = np.array([get_id(plant, unknown_plant_id) for plant in layout.plants], dtype=np.int32)
+
+        cells = np.tile(np.frombuffer(layout.cells, dtype=np.uint16), (len(plans), 1))
+        if len(layout.movable_indices) > 0:
+            genomes = np.frombuffer(b"".join(plan.genome.tobytes() for plan in plans), dtype=np.uint16)
+            cells[:, list(layout.movable_indices)] = genomes.reshape(len(plans), -1)
+
+        return list(layout.positions), matrix_ids[cells]
+
+    def evaluate_grids(self, grids: np.ndarray, score_table: np.ndarray = None) -> np.ndarray:
+        """
+        Returns the fitness of every plan in a (pop, H, W) tensor created by `to_grids`. The score_table has to
+        belong to the same matrix as the ids of the grids and defaults to the current one.
+        """
+        if grids.shape[1] < 3 or grids.shape[2] < 3:
+            return np.zeros(len(grids), dtype=np.float64)
+
+        # Index into the flattened score table, as that is a lot faster than indexing with two arrays
+        scores = self.score_table if score_table is None else score_table
+        flat_scores = scores.ravel()
+
+        height, width = grids.shape[1:]
+        centers = grids[:, 1:-1, 1:-1]
+        row_offsets = centers * scores.shape[1]
+
+        cell_scores = np.zeros(centers.shape, dtype=np.float64)
+        for (dx, dy, weight) in AFFECTED_TILES:
+            neighbours = grids[:, 1+dy:height-1+dy, 1+dx:width-1+dx]
+            cell_scores += flat_scores[row_offsets + neighbours] * weight
+
+        occupied = centers != EMPTY_ID
+        non_empty_counts = occupied.sum(axis=(1, 2))
+        total_scores = np.where(occupied, cell_scores, 0).sum(axis=(1, 2))
+
+        denominator = non_empty_counts * len(AFFECTED_TILES) * max(self.negative_weight, self.positive_weight)
+        return np.divide(total_scores, denominator,
+                         out=np.zeros(len(grids), dtype=np.float64), where=non_empty_counts > 0)
+
+    def evaluate_population(self, plans: typing.Sequence[typing.Union[Plan, CompactPlan]]) -> typing.List[float]:
+        """ Returns the fitness of every plan in the same order. """
+        # The ids and the score table have to belong to the same matrix, even if another thread switches it
+        matrix, _, score_table = self._get_matrix_state()
+        return self.evaluate_grids(self.to_grids(plans, matrix), score_table).tolist()
+
+    def evaluate(self, plan: typing.Union[Plan, CompactPlan]) -> float:
+        return self.evaluate_population([plan])[0]
+
+
+VECTORIZED_EVALUATOR = VectorizedSymbiosisEvaluator(negative_weight=2)
+
+
+def evaluate_population_fitness(plans: typing.Sequence[typing.Union[Plan, CompactPlan]]) -> typing.List[float]:
+    return VECTORIZED_EVALUATOR.evaluate_population(plans)
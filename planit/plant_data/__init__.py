@@ -1,30 +1,114 @@
 # -*- coding: utf-8 -*-
 
-from .db import Db
-from typing import Dict, List
+import os
+import threading
+from .db import Db, get_db_path
+from .snapshot import Snapshot, get_snapshot_path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
-# Create db object
-db: Db = Db()
+# The import binds the submodule to db, which is provided by __getattr__ instead
+del db
+
+# The db is opened on first use, so importing the package does no I/O
+_db: Optional[Db] = None
+_db_lock: threading.Lock = threading.Lock()
+
+def get_db() -> Db:
+    """ Get the db object and open the db on first use. """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = Db()
+    return _db
+
+# The snapshot is read instead of the db if it is newer
+_snapshot: Optional[Snapshot] = None
+_snapshot_checked: bool = False
+
+def _get_modification_time(path: str) -> float:
+    """ Get the modification time of a file or 0 if it does not exist. """
+    return os.path.getmtime(path) if os.path.exists(path) else 0
+
+def get_reader() -> Union[Db, Snapshot]:
+    """
+    Get the snapshot if it is newer than the db, which includes its WAL file,
+    or else the db.
+    """
+    global _snapshot, _snapshot_checked
+    if not _snapshot_checked:
+        with _db_lock:
+            if not _snapshot_checked:
+                path: str = get_snapshot_path()
+                db_time: float = max(
+                    _get_modification_time(get_db_path()),
+                    _get_modification_time(get_db_path() + '-wal'))
+                if os.path.exists(path) and os.path.getmtime(path) >= db_time:
+                    _snapshot = Snapshot(path)
+                _snapshot_checked = True
+    return get_db() if _snapshot is None else _snapshot
+
+def _get_writer() -> Db:
+    """ Get the db and stop reading the snapshot, as it becomes outdated. """
+    global _snapshot, _snapshot_checked
+    with _db_lock:
+        _snapshot = None
+        _snapshot_checked = True
+    return get_db()
+
+def __getattr__(name: str) -> Any:
+    """ Keep plant_data.db working by opening the db on first access. """
+    if name == 'db':
+        return get_db()
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
 
 
 # Provide functions
 
 def overwrite(name: str) -> None:
     """ Overwrite a table. """
-    db.overwrite(name)
+    _get_writer().overwrite(name)
 
 def add_plant(common_name: str) -> bool:
     """ Add a plant to the db if it does not exist so far. """
-    return db.add_plant(common_name)
+    return _get_writer().add_plant(common_name)
 
 def add_symbiosis_score(plant_a: str, plant_b: str, score: int = 0) -> bool:
     """ Add a symbiosis score to the db if it does not exist so far. """
-    return db.add_symbiosis_score(plant_a, plant_b, score)
+    return _get_writer().add_symbiosis_score(plant_a, plant_b, score)
+
+def add_plants_and_symbiosis_scores(
+    common_names: Iterable[str],
+    symbioses: Iterable[Tuple[str, str, int]]) -> Tuple[int, int]:
+    """ Add many plants and symbiosis scores in a single transaction. """
+    return _get_writer().add_plants_and_symbiosis_scores(common_names, symbioses)
+
+def sync(common_names: Iterable[str],
+         symbioses: Iterable[Tuple[str, str, int]]) -> Tuple[int, int]:
+    """ Write only the differences to the given plants and symbiosis scores. """
+    return _get_writer().sync(common_names, symbioses)
 
 def get_all_plants() -> List[str]:
     """ Get all plants from the db. """
-    return db.get_all_plants()
+    return get_reader().get_all_plants()
 
 def get_symbiosis_score(plant_a: str, plant_b: str) -> int:
     """ Get the symbiosis score of the plants a and b from the db. """
-    return db.get_symbiosis_score(plant_a, plant_b)
+    return get_reader().get_symbiosis_score(plant_a, plant_b)
+
+def get_symbiosis_scores(pairs: Iterable[Tuple[str, str]]) -> List[int]:
+    """ Get the symbiosis scores of many pairs of plants (plant_a, plant_b). """
+    return get_reader().get_symbiosis_scores(pairs)
+
+def get_symbiosis_submatrix(
+    plants: Iterable[str]) -> Tuple[Dict[str, int], List[List[int]]]:
+    """ Get the index of each plant and the matrix of their symbiosis scores. """
+    return get_reader().get_symbiosis_submatrix(plants)
+
+def get_all_symbioses() -> List[Tuple[str, str, int]]:
+    """ Get every symbiosis score from the db as (plant_a, plant_b, score). """
+    return get_reader().get_all_symbioses()
+
+def get_symbioses_version() -> int:
+    """ Get a number that changes whenever the symbioses change. """
+    return get_reader().get_symbioses_version()
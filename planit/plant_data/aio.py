@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asyncio
+
+Provides the functions of plant_data as coroutines. They run on a dedicated
+executor, so they do not block the event loop while waiting for the db.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from planit import plant_data
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# Threads that access the db on behalf of the event loop. Each of them reads
+# with its own connection of the pool.
+_executor: ThreadPoolExecutor = ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix='plant_data')
+
+async def _run(func: Callable[..., Any], *args: Any) -> Any:
+    """ Run a function on the executor of plant_data. """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args))
+
+
+# Provide coroutines
+
+async def overwrite(name: str) -> None:
+    """ Overwrite a table. """
+    await _run(plant_data.overwrite, name)
+
+async def add_plant(common_name: str) -> bool:
+    """ Add a plant to the db if it does not exist so far. """
+    return await _run(plant_data.add_plant, common_name)
+
+async def add_symbiosis_score(plant_a: str, plant_b: str, score: int = 0) -> bool:
+    """ Add a symbiosis score to the db if it does not exist so far. """
+    return await _run(plant_data.add_symbiosis_score, plant_a, plant_b, score)
+
+async def add_plants_and_symbiosis_scores(
+    common_names: Iterable[str],
+    symbioses: Iterable[Tuple[str, str, int]]) -> Tuple[int, int]:
+    """ Add many plants and symbiosis scores in a single transaction. """
+    return await _run(plant_data.add_plants_and_symbiosis_scores,
+                      common_names, symbioses)
+
+async def sync(common_names: Iterable[str],
+               symbioses: Iterable[Tuple[str, str, int]]) -> Tuple[int, int]:
+    """ Write only the differences to the given plants and symbiosis scores. """
+    return await _run(plant_data.sync, common_names, symbioses)
+
+async def get_all_plants() -> List[str]:
+    """ Get all plants from the db. """
+    return await _run(plant_data.get_all_plants)
+
+async def get_symbiosis_score(plant_a: str, plant_b: str) -> int:
+    """ Get the symbiosis score of the plants a and b from the db. """
+    return await _run(plant_data.get_symbiosis_score, plant_a, plant_b)
+
+async def get_symbiosis_scores(pairs: Iterable[Tuple[str, str]]) -> List[int]:
+    """ Get the symbiosis scores of many pairs of plants (plant_a, plant_b). """
+    return await _run(plant_data.get_symbiosis_scores, pairs)
+
+async def get_symbiosis_submatrix(
+    plants: Iterable[str]) -> Tuple[Dict[str, int], List[List[int]]]:
+    """ Get the index of each plant and the matrix of their symbiosis scores. """
+    return await _run(plant_data.get_symbiosis_submatrix, plants)
+
+async def get_all_symbioses() -> List[Tuple[str, str, int]]:
+    """ Get every symbiosis score from the db as (plant_a, plant_b, score). """
+    return await _run(plant_data.get_all_symbioses)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+Connection pool
+
+Provides sqlite3 connections to a db file for multiple threads.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from urllib.request import pathname2url
+
+class ConnectionPool:
+    """
+    Provide a read-only connection per thread and a single writer connection
+    to a db file. The db uses WAL mode, so readers do not block each other or
+    the writer, while writes are serialised by a lock.
+    """
+
+    def __init__(self, path: str):
+
+        # URI of the db file for the read-only connections
+        self._uri: str = 'file:{}?mode=ro'.format(
+            pathname2url(os.path.abspath(path)))
+
+        # Connections of the readers by thread
+        self._local: threading.local = threading.local()
+
+        # The writer may be used by any thread while holding the lock
+        self._write_lock: threading.RLock = threading.RLock()
+        self._writer: sqlite3.Connection = sqlite3.connect(
+            path, check_same_thread=False)
+        self._writer.execute('PRAGMA journal_mode = WAL;')
+        self._writer.execute('PRAGMA foreign_keys = ON;')
+
+    def get_reader(self) -> sqlite3.Connection:
+        """ Get the read-only connection of the current thread. """
+
+        connection: Optional[sqlite3.Connection] = getattr(
+            self._local, 'connection', None)
+
+        # Connect on first use in this thread
+        if connection is None:
+            connection = sqlite3.connect(self._uri, uri=True)
+            self._local.connection = connection
+
+        return connection
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """ Lock the writer connection while using it. """
+
+        with self._write_lock:
+            yield self._writer
+
+    def close(self) -> None:
+        """
+        Close the writer and the reader of the current thread. The readers of
+        other threads are closed when their threads end.
+        """
+
+        connection: Optional[sqlite3.Connection] = getattr(
+            self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+        with self._write_lock:
+            self._writer.close()
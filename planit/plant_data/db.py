@@ -3,28 +3,65 @@
 import logging
 import os
 import sqlite3
+import threading
 from planit import resources
+from .connection_pool import ConnectionPool
 from .log import createLogger
-from functools import lru_cache
-from typing import Any, Dict, Iterable, List, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 # Path of the log dir
 basePath: str = 'plantdata/'
 
+# Version of the schema that is stored in PRAGMA user_version
+schemaVersion: int = 1
+
+# Add a plant or list it if it is only known as the partner of a symbiosis
+sqlAddPlant: str = ('INSERT INTO plants (common_name) VALUES (?) ' +
+                    'ON CONFLICT (common_name) DO UPDATE SET listed = 1 ' +
+                    'WHERE listed = 0')
+
+# Add a plant that is only known as the partner of a symbiosis
+sqlAddPartner: str = ('INSERT OR IGNORE INTO plants (common_name, listed) ' +
+                      'VALUES (?, 0)')
+
+# Select the IDs of a pair (plant_a, plant_b) with the smaller ID first
+sqlWithPair: str = ('WITH pair (a_id, b_id) AS (SELECT min(a.id, b.id), ' +
+                    'max(a.id, b.id) FROM plants a, plants b ' +
+                    'WHERE a.common_name = ? AND b.common_name = ?) ')
+
+# Add a symbiosis score (score, plant_a, plant_b) with the smaller ID first
+sqlAddSymbiosis: str = ('INSERT OR IGNORE INTO symbioses ' +
+                        'SELECT min(a.id, b.id), max(a.id, b.id), ? ' +
+                        'FROM plants a, plants b ' +
+                        'WHERE a.common_name = ? AND b.common_name = ?')
+
+def get_db_path() -> str:
+    """ Get the path of the db file. """
+    return os.path.join(resources.get(basePath), 'planit.db')
+
 class Db:
-    """ Connect to a sqlite3 database and execute SQL statements. """
+    """
+    Connect to a sqlite3 database and execute SQL statements. A Db may be used
+    by multiple threads: reads run concurrently, writes are serialised.
+    """
 
     def __init__(self):
 
         # Path to the db file
-        path: str = os.path.join(resources.get(basePath), 'planit.db')
+        path: str = get_db_path()
 
         # Use logger
         # TODO: Type hint for logger
         self._logger = createLogger('db')
 
         # Connect to the db
-        self._connection: sqlite3.Connection = sqlite3.connect(path)
+        self._pool: ConnectionPool = ConnectionPool(path)
+
+        # All symbiosis scores by plant a and plant b in both directions. They
+        # are loaded on first use and reloaded after the symbioses changed.
+        self._symbioses: Optional[Dict[str, Dict[str, int]]] = None
+        self._symbioses_version: int = 0
+        self._symbioses_lock: threading.Lock = threading.Lock()
 
         # Create missing tables
         self._create_tables()
@@ -33,85 +70,300 @@ class Db:
         self, sql: str, values: Iterable[Any] = []) -> List[Tuple[str, ...]]:
         """ Execute a SQL statement securely. """
 
-        try:
+        with self._pool.write() as connection:
+            try:
 
-            # Execute the SQL statement
-            cursor: sqlite3.Cursor = self._connection.cursor()
-            cursor.execute(sql, values)
-            logging.debug("Execute '{}' with values '{}'".format(sql, values))
+                # Execute the SQL statement
+                cursor: sqlite3.Cursor = connection.cursor()
+                cursor.execute(sql, values)
+                logging.debug("Execute '{}' with values '{}'".format(sql, values))
 
-            # Get rows
-            rows: List[Tuple[str, ...]] = cursor.fetchall()
+                # Get rows
+                rows: List[Tuple[str, ...]] = cursor.fetchall()
 
-            self._connection.commit()
-            return rows
+                connection.commit()
+                return rows
 
-        except Exception as e:
+            except Exception as e:
 
-            # Rollback on exception
-            logging.warning("Database rollback because of '{}'".format(e))
-            self._connection.rollback()
+                # Rollback on exception
+                logging.warning("Database rollback because of '{}'".format(e))
+                connection.rollback()
 
-            # Reraise exception
-            raise e
+                # Reraise exception
+                raise e
 
-    def _create_tables(self) -> None:
-        """ Create the tables plants and symbioses. """
+    def _read_sql(
+        self, sql: str, values: Iterable[Any] = []) -> List[Tuple[str, ...]]:
+        """ Execute a read-only SQL statement with the connection of the thread. """
+
+        cursor: sqlite3.Cursor = self._pool.get_reader().cursor()
+        cursor.execute(sql, values)
+        logging.debug("Read '{}' with values '{}'".format(sql, values))
+
+        return cursor.fetchall()
+
+    def _execute_many_sql(
+        self, statements: Iterable[Tuple[str, Iterable[Iterable[Any]]]]) -> List[int]:
+        """
+        Execute each SQL statement for many values in a single transaction and
+        return the number of changed rows of each statement.
+        """
+
+        with self._pool.write() as connection:
+            try:
 
-        sql: str = 'CREATE TABLE IF NOT EXISTS {} ({});'
+                # Execute the SQL statements
+                row_counts: List[int] = []
+                cursor: sqlite3.Cursor = connection.cursor()
+                for sql, values in statements:
+                    cursor.executemany(sql, values)
+                    logging.debug("Execute '{}' for many values".format(sql))
+                    row_counts.append(cursor.rowcount)
+
+                connection.commit()
+                return row_counts
+
+            except Exception as e:
+
+                # Rollback on exception
+                logging.warning("Database rollback because of '{}'".format(e))
+                connection.rollback()
+
+                # Reraise exception
+                raise e
+
+    def _get_user_version(self) -> int:
+        """ Get the version of the schema of the db file. """
+
+        return int(self._read_sql('PRAGMA user_version;')[0][0])
+
+    def _has_table(self, name: str) -> bool:
+        """ Check whether a table exists in the db file. """
+
+        sql: str = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?;"
+        return len(self._read_sql(sql, [name])) > 0
+
+    def _get_create_table_sql(self) -> List[str]:
+        """ Get the statements that create the tables plants and symbioses. """
+
+        sql: str = 'CREATE TABLE IF NOT EXISTS {} ({}){};'
         tables: Dict[str, List[str]] = {
+            # Plants that only occur as the partner of a symbiosis are not
+            # listed, but still need an ID
             'plants':
-            ['common_name TEXT PRIMARY KEY'],
+            ['id INTEGER PRIMARY KEY', 'common_name TEXT UNIQUE NOT NULL',
+            'listed INTEGER NOT NULL DEFAULT 1'],
+            # Each pair is stored once with the smaller plant ID first
             'symbioses':
-            ['plant_a TEXT NOT NULL', 'plant_b TEXT NOT NULL',
-            'score INTEGER NOT NULL']
+            ['plant_a_id INTEGER NOT NULL REFERENCES plants (id)',
+            'plant_b_id INTEGER NOT NULL REFERENCES plants (id)',
+            'score INTEGER NOT NULL', 'PRIMARY KEY (plant_a_id, plant_b_id)',
+            'CHECK (plant_a_id <= plant_b_id)']
         }
+        options: Dict[str, str] = {'plants': '', 'symbioses': ' WITHOUT ROWID'}
+
+        return [sql.format(name, ', '.join(tables[name]), options[name])
+                for name in tables]
+
+    def _migrate_from_version_0(self) -> None:
+        """
+        Upgrade the tables of version 0, which stored the names of the plants
+        in the symbioses table without any key, in a single transaction.
+        """
+
+        script: List[str] = [
+            'BEGIN;',
+            'CREATE TABLE IF NOT EXISTS plants (common_name TEXT PRIMARY KEY);',
+            'CREATE TABLE IF NOT EXISTS symbioses (plant_a TEXT NOT NULL, ' +
+            'plant_b TEXT NOT NULL, score INTEGER NOT NULL);',
+            'DROP INDEX IF EXISTS symbioses_pair;',
+            'ALTER TABLE plants RENAME TO plants_v0;',
+            'ALTER TABLE symbioses RENAME TO symbioses_v0;',
+            *self._get_create_table_sql(),
+            'INSERT INTO plants (common_name) ' +
+            'SELECT common_name FROM plants_v0 ORDER BY rowid;',
+            'INSERT OR IGNORE INTO plants (common_name, listed) ' +
+            'SELECT plant_a, 0 FROM symbioses_v0 ORDER BY rowid;',
+            'INSERT OR IGNORE INTO plants (common_name, listed) ' +
+            'SELECT plant_b, 0 FROM symbioses_v0 ORDER BY rowid;',
+            # The first score of a pair wins like in the old lookup
+            'INSERT OR IGNORE INTO symbioses ' +
+            'SELECT min(a.id, b.id), max(a.id, b.id), s.score ' +
+            'FROM symbioses_v0 s JOIN plants a ON a.common_name = s.plant_a ' +
+            'JOIN plants b ON b.common_name = s.plant_b ORDER BY s.rowid;',
+            'DROP TABLE symbioses_v0;',
+            'DROP TABLE plants_v0;',
+            'PRAGMA user_version = 1;',
+            'COMMIT;'
+        ]
+
+        with self._pool.write() as connection:
+            try:
+                connection.executescript('\n'.join(script))
+                logging.debug('Migrated the db to schema version 1')
+
+            except Exception as e:
+
+                # Rollback on exception
+                logging.warning("Database rollback because of '{}'".format(e))
+                connection.rollback()
+
+                # Reraise exception
+                raise e
+
+    def _create_tables(self) -> None:
+        """ Create the tables plants and symbioses or upgrade old ones. """
 
-        for name in tables:
-            self._execute_sql(sql.format(name, ', '.join(tables[name])))
+        # Existing db files without a version have the old schema
+        if self._get_user_version() == 0 and (
+                self._has_table('plants') or self._has_table('symbioses')):
+            self._migrate_from_version_0()
+
+        for sql in self._get_create_table_sql():
+            self._execute_sql(sql)
+
+        # Only write the version if it changed to keep the db file untouched
+        if self._get_user_version() != schemaVersion:
+            self._execute_sql('PRAGMA user_version = {};'.format(schemaVersion))
+
+    def close(self) -> None:
+        """ Close the connections to the db. """
+
+        self._pool.close()
 
     def overwrite(self, name: str) -> None:
-        """ Overwrite a table. """
+        """
+        Overwrite a table. Overwriting the plants also overwrites the
+        symbioses, as they reference the IDs of the plants.
+        """
 
         sql: str = 'DROP TABLE IF EXISTS {};'
+        if name == 'plants':
+            self._execute_sql(sql.format('symbioses'))
         self._execute_sql(sql.format(name))
         self._create_tables()
+        self._invalidate_symbioses()
 
     def add_plant(self, common_name: str) -> bool:
         """ Add a plant to the db if it does not exist so far. """
 
-        sql: str = 'INSERT INTO plants VALUES (?)'
+        # A plant that is only known as a partner of a symbiosis gets listed
         values: List[str] = [common_name]
-        try:
-            self._execute_sql(sql, values)
+        if self._execute_many_sql([(sqlAddPlant, [values])])[0] == 1:
             return True
-        except sqlite3.IntegrityError as e:
-            logging.debug("Integrity error: '{}'".format(e))
-            return False
+        logging.debug('Integrity error')
+        return False
 
     def add_symbiosis_score(self, plant_a: str, plant_b: str,
                             score: int) -> bool:
         """ Add a symbiosis score to the db if it does not exist so far. """
 
-        sql_integrity: str = ('SELECT 1 FROM symbioses WHERE plant_a = ? AND ' +
-                              'plant_b = ? OR plant_a = ? AND plant_b = ?')
-        values_integrity: List[str] = [plant_a, plant_b, plant_b, plant_a]
-        sql_insert: str = 'INSERT INTO symbioses VALUES (?, ?, ?)'
-        values_insert: List[Union[str, int]] = [plant_a, plant_b, score]
+        values: List[Union[str, int]] = [score, plant_a, plant_b]
 
-        # Check integrity and insert the symbiosis score
-        if len(self._execute_sql(sql_integrity, values_integrity)) == 0:
-            self._execute_sql(sql_insert, values_insert)
+        # The primary key ignores the score if the pair already exists
+        row_counts: List[int] = self._execute_many_sql([
+            (sqlAddPartner, [[plant_a], [plant_b]]),
+            (sqlAddSymbiosis, [values])
+        ])
+        if row_counts[1] == 1:
+            self._invalidate_symbioses()
             return True
         logging.debug('Integrity error')
         return False
 
+    def add_plants_and_symbiosis_scores(
+        self, common_names: Iterable[str],
+        symbioses: Iterable[Tuple[str, str, int]]) -> Tuple[int, int]:
+        """
+        Add many plants and symbiosis scores (plant_a, plant_b, score) in a
+        single transaction. Existing plants and pairs are skipped, so the first
+        score of a pair wins. Return the number of added plants and scores.
+        """
+
+        symbioses = list(symbioses)
+        plant_count, _, symbiosis_count = self._execute_many_sql([
+            (sqlAddPlant, ([common_name] for common_name in common_names)),
+            (sqlAddPartner, ([plant] for symbiosis in symbioses
+                             for plant in symbiosis[:2])),
+            (sqlAddSymbiosis, ([score, plant_a, plant_b]
+                               for plant_a, plant_b, score in symbioses))
+        ])
+        if symbiosis_count > 0:
+            self._invalidate_symbioses()
+
+        return plant_count, symbiosis_count
+
+    def sync(self, common_names: Iterable[str],
+             symbioses: Iterable[Tuple[str, str, int]]) -> Tuple[int, int]:
+        """
+        Make the plants and symbiosis scores (plant_a, plant_b, score) of the
+        db equal to the given ones. Only the differences are written in a
+        single transaction, so readers never see missing data. The first score
+        of a pair wins. Return the number of changed plants and scores.
+        """
+
+        # Remove mirrored pairs and neutral scores, as they are the default
+        new_plants: Dict[str, None] = dict.fromkeys(common_names)
+        new_symbioses: Dict[Tuple[str, str], int] = {}
+        for plant_a, plant_b, score in symbioses:
+            pair: Tuple[str, str] = (min(plant_a, plant_b), max(plant_a, plant_b))
+            new_symbioses.setdefault(pair, score)
+        new_symbioses = {pair: score for pair, score in new_symbioses.items()
+                         if score != 0}
+
+        # Writes of other threads must not happen between reading and writing
+        with self._pool.write():
+            old_plants: Dict[str, None] = dict.fromkeys(self.get_all_plants())
+            old_symbioses: Dict[Tuple[str, str], int] = {
+                (min(plant_a, plant_b), max(plant_a, plant_b)): score
+                for plant_a, plant_b, score in self.get_all_symbioses()}
+
+            # Compute the differences
+            listed: List[List[str]] = [[plant] for plant in new_plants
+                                       if plant not in old_plants]
+            unlisted: List[List[str]] = [[plant] for plant in old_plants
+                                         if plant not in new_plants]
+            deleted: List[Tuple[str, str]] = [pair for pair in old_symbioses
+                                              if pair not in new_symbioses]
+            changed: Dict[Tuple[str, str], int] = {
+                pair: score for pair, score in new_symbioses.items()
+                if old_symbioses.get(pair) != score}
+
+            # Apply them
+            sql_unlist: str = 'UPDATE plants SET listed = 0 WHERE common_name = ?'
+            sql_delete: str = (sqlWithPair + 'DELETE FROM symbioses ' +
+                               'WHERE (plant_a_id, plant_b_id) IN pair')
+            sql_update: str = (sqlWithPair + 'UPDATE symbioses SET score = ? ' +
+                               'WHERE (plant_a_id, plant_b_id) IN pair')
+            sql_delete_partners: str = (
+                'DELETE FROM plants WHERE listed = 0 AND id NOT IN ' +
+                '(SELECT plant_a_id FROM symbioses UNION ' +
+                'SELECT plant_b_id FROM symbioses)')
+            self._execute_many_sql([
+                (sqlAddPlant, listed),
+                (sql_unlist, unlisted),
+                (sql_delete, [list(pair) for pair in deleted]),
+                (sql_update, ([*pair, score] for pair, score in changed.items()
+                              if pair in old_symbioses)),
+                (sqlAddPartner, ([plant] for pair in changed for plant in pair)),
+                (sqlAddSymbiosis, ([score, *pair] for pair, score in changed.items()
+                                   if pair not in old_symbioses)),
+                (sql_delete_partners, [[]])
+            ])
+
+        # Only the scores of the changed plants have to be reloaded
+        self._update_symbioses([(*pair, 0) for pair in deleted] +
+                               [(*pair, score) for pair, score in changed.items()])
+
+        return len(listed) + len(unlisted), len(deleted) + len(changed)
+
     def get_all_plants(self) -> List[str]:
         """ Get all plants from the db. """
 
         # Get the common names
-        sql: str = 'SELECT common_name FROM plants;'
-        rows: List[Tuple[str, ...]] = self._execute_sql(sql)
+        sql: str = 'SELECT common_name FROM plants WHERE listed = 1;'
+        rows: List[Tuple[str, ...]] = self._read_sql(sql)
 
         # Sort the plants
         plants: List[str] = []
@@ -120,19 +372,118 @@ class Db:
 
         return plants
 
-    # Max size of 500 items for LRU cache to prevent the app from using too much
-    # memory
-    @lru_cache(500)
+    def get_all_symbioses(self) -> List[Tuple[str, str, int]]:
+        """ Get every symbiosis score from the db as (plant_a, plant_b, score). """
+
+        sql: str = ('SELECT a.common_name, b.common_name, s.score ' +
+                    'FROM symbioses s JOIN plants a ON a.id = s.plant_a_id ' +
+                    'JOIN plants b ON b.id = s.plant_b_id;')
+        rows: List[Tuple[str, ...]] = self._read_sql(sql)
+
+        return [(row[0], row[1], int(row[2])) for row in rows]
+
+    def _invalidate_symbioses(self) -> None:
+        """ Reload the symbiosis scores on their next use. """
+
+        with self._symbioses_lock:
+            self._symbioses = None
+            self._symbioses_version += 1
+
+    def _get_symbioses(self) -> Dict[str, Dict[str, int]]:
+        """ Get all symbiosis scores by plant a and plant b from memory. """
+
+        symbioses: Optional[Dict[str, Dict[str, int]]] = self._symbioses
+        if symbioses is None:
+
+            # The graph is small, so load all of it at once
+            version: int = self._symbioses_version
+            symbioses = {}
+            for plant_a, plant_b, score in self.get_all_symbioses():
+                symbioses.setdefault(plant_a, {})[plant_b] = score
+                symbioses.setdefault(plant_b, {})[plant_a] = score
+
+            # Another thread may have changed the symbioses while loading
+            with self._symbioses_lock:
+                if version == self._symbioses_version:
+                    self._symbioses = symbioses
+
+        return symbioses
+
+    def _update_symbioses(self, symbioses: List[Tuple[str, str, int]]) -> None:
+        """
+        Change the given scores (plant_a, plant_b, score) of the loaded
+        symbioses, where 0 removes a score, instead of reloading all of them.
+        """
+
+        if len(symbioses) == 0:
+            return
+
+        with self._symbioses_lock:
+            self._symbioses_version += 1
+            if self._symbioses is None:
+                return
+
+            # Copy the changed plants, as other threads may read the old ones
+            updated: Dict[str, Dict[str, int]] = dict(self._symbioses)
+            for plant_a, plant_b, _ in symbioses:
+                updated[plant_a] = dict(updated.get(plant_a, {}))
+                updated[plant_b] = dict(updated.get(plant_b, {}))
+            for plant_a, plant_b, score in symbioses:
+                if score == 0:
+                    updated[plant_a].pop(plant_b, None)
+                    updated[plant_b].pop(plant_a, None)
+                else:
+                    updated[plant_a][plant_b] = updated[plant_b][plant_a] = score
+            self._symbioses = updated
+
+    def get_symbioses_version(self) -> int:
+        """ Get a number that changes whenever the symbioses change. """
+
+        return self._symbioses_version
+
     def get_symbiosis_score(self, plant_a: str, plant_b: str) -> int:
         """ Get the symbiosis score of the plants a and b from the db. """
 
-        # Find the symbiosis in the db
-        sql: str = ('SELECT score FROM symbioses WHERE plant_a = ? AND ' +
-                    'plant_b = ? OR plant_a = ? AND plant_b = ?')
-        values: List[str] = [plant_a, plant_b, plant_b, plant_a]
-        symbiosis_score: List[Tuple[str, ...]] = self._execute_sql(sql, values)
-        if not len(symbiosis_score) == 0:
-            return int(symbiosis_score[0][0])
-
         # Default 0
-        return 0
+        return self._get_symbioses().get(plant_a, {}).get(plant_b, 0)
+
+    def get_symbiosis_scores(
+        self, pairs: Iterable[Tuple[str, str]]) -> List[int]:
+        """ Get the symbiosis scores of many pairs of plants (plant_a, plant_b). """
+
+        symbioses: Dict[str, Dict[str, int]] = self._get_symbioses()
+        return [symbioses.get(plant_a, {}).get(plant_b, 0)
+                for plant_a, plant_b in pairs]
+
+    def get_symbiosis_submatrix(
+        self, plants: Iterable[str]) -> Tuple[Dict[str, int], List[List[int]]]:
+        """
+        Get the symbiosis scores between every pair of the plants with a single
+        query. Return the index of each plant and the symmetric matrix of the
+        scores, in which unknown pairs have the score 0.
+        """
+
+        # Index the plants in the given order without duplicates
+        indices: Dict[str, int] = {}
+        for plant in plants:
+            indices.setdefault(plant, len(indices))
+        matrix: List[List[int]] = [[0] * len(indices) for _ in indices]
+        if len(indices) == 0:
+            return indices, matrix
+
+        # Get the symbioses in which both plants are wanted
+        sql: str = ('WITH wanted (id) AS (SELECT id FROM plants ' +
+                    'WHERE common_name IN ({})) '.format(
+                        ', '.join('?' * len(indices))) +
+                    'SELECT a.common_name, b.common_name, s.score ' +
+                    'FROM symbioses s JOIN plants a ON a.id = s.plant_a_id ' +
+                    'JOIN plants b ON b.id = s.plant_b_id ' +
+                    'WHERE s.plant_a_id IN wanted AND s.plant_b_id IN wanted;')
+        rows: List[Tuple[str, ...]] = self._read_sql(sql, list(indices))
+
+        # Mirror the scores, as each pair is only stored once
+        for plant_a, plant_b, score in rows:
+            a, b = indices[plant_a], indices[plant_b]
+            matrix[a][b] = matrix[b][a] = int(score)
+
+        return indices, matrix
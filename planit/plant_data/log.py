@@ -10,20 +10,40 @@ import logging
 import sys
 import os
 from planit import resources
+from typing import List
 
 # Path of the log dir
 basePath: str = 'log/'
 
 # TODO: Type hint for returned logger
 def createLogger(name):
-    """ Create a logger with a file and stream handler on debug level. """
+    """
+    Create a logger with a file and stream handler on debug level. Calling it
+    again does not add the same handlers twice.
+    """
+
+    # TODO: Type hint for logger
+    logger = logging.getLogger()
 
     # Name the log file after the logger
     path: str = os.path.join(resources.get(basePath), f'{name}.log')
 
+    # Skip handlers that were already added by an earlier call
+    hasFileHandler: bool = any(
+        isinstance(handler, logging.FileHandler)
+        and handler.baseFilename == os.path.abspath(path)
+        for handler in logger.handlers)
+    hasStreamHandler: bool = any(
+        type(handler) is logging.StreamHandler
+        and handler.stream is sys.stdout
+        for handler in logger.handlers)
+
     # Create file handler and stream handler for console logging
-    fileHandler: logging.FileHandler = logging.FileHandler(path)
-    streamHandler: logging.StreamHandler = logging.StreamHandler(sys.stdout)
+    handlers: List[logging.Handler] = []
+    if not hasFileHandler:
+        handlers.append(logging.FileHandler(path))
+    if not hasStreamHandler:
+        handlers.append(logging.StreamHandler(sys.stdout))
 
     # Set logging format
     frm: logging.Formatter = logging.Formatter(
@@ -31,14 +51,11 @@ def createLogger(name):
         '%Y-%m-%d %H:%M:%S',
         style = '{'
     )
-    fileHandler.setFormatter(frm)
-    streamHandler.setFormatter(frm)
 
-    # Create logger and add handlers
-    # TODO: Type hint for logger
-    logger = logging.getLogger()
-    logger.addHandler(fileHandler)
-    logger.addHandler(streamHandler)
+    # Add handlers to the logger
+    for handler in handlers:
+        handler.setFormatter(frm)
+        logger.addHandler(handler)
     logger.setLevel(logging.INFO)
 
     return logger
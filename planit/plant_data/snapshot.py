@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+Snapshot
+
+Provides a read-only binary snapshot of the plant db that is memory-mapped, so
+it loads without opening the db and processes share the same pages.
+
+The file contains a header (magic, number of plants, size of the string
+table), the names of the plants separated by newlines, a byte per plant that
+is 1 if the plant is listed and the symmetric matrix of the symbiosis scores
+as int8.
+"""
+
+import mmap
+import os
+import struct
+from planit import resources
+from typing import Dict, Iterable, List, Tuple
+
+# Path of the snapshot dir
+basePath: str = 'plantdata/'
+
+# Magic and version of the file format
+magic: bytes = b'PLANITS1'
+
+# Magic, number of plants and size of the string table
+headerFormat: str = '<8sII'
+
+def get_snapshot_path() -> str:
+    """ Get the path of the snapshot file. """
+    return os.path.join(resources.get(basePath), 'planit.snapshot')
+
+def write_snapshot(path: str, plants: Iterable[str],
+                   symbioses: Iterable[Tuple[str, str, int]]) -> None:
+    """
+    Write a snapshot of the listed plants and the symbiosis scores
+    (plant_a, plant_b, score). The file is replaced atomically, so processes
+    that have mapped the old snapshot keep working.
+    """
+
+    # Index the listed plants first and then the partners of the symbioses
+    indices: Dict[str, int] = {}
+    for plant in plants:
+        indices.setdefault(plant, len(indices))
+    listed_count: int = len(indices)
+    symbioses = list(symbioses)
+    for plant_a, plant_b, _ in symbioses:
+        indices.setdefault(plant_a, len(indices))
+        indices.setdefault(plant_b, len(indices))
+
+    # Mirror the scores, as each pair is only stored once
+    count: int = len(indices)
+    scores: bytearray = bytearray(count * count)
+    for plant_a, plant_b, score in symbioses:
+        if not -128 <= score <= 127:
+            raise ValueError("Score {} of '{}' and '{}' does not fit into int8"
+                             .format(score, plant_a, plant_b))
+        a, b = indices[plant_a], indices[plant_b]
+        scores[a * count + b] = scores[b * count + a] = score & 0xFF
+
+    names: bytes = '\n'.join(indices).encode('utf-8')
+    listed: bytes = bytes(1 if i < listed_count else 0 for i in range(count))
+
+    # Write a temporary file and replace the snapshot with it
+    temp_path: str = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(struct.pack(headerFormat, magic, count, len(names)))
+        file.write(names)
+        file.write(listed)
+        file.write(scores)
+    os.replace(temp_path, path)
+
+class Snapshot:
+    """ Read the plants and symbiosis scores from a memory-mapped snapshot. """
+
+    def __init__(self, path: str):
+
+        # Map the file read-only
+        with open(path, 'rb') as file:
+            self._mmap: mmap.mmap = mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        file_magic, count, names_size = struct.unpack_from(
+            headerFormat, self._mmap)
+        if file_magic != magic:
+            self._mmap.close()
+            raise ValueError("'{}' is not a plant data snapshot".format(path))
+
+        # The names are decoded once, the scores stay in the mapped pages
+        offset: int = struct.calcsize(headerFormat)
+        names: str = self._mmap[offset:offset + names_size].decode('utf-8')
+        self._plants: List[str] = names.split('\n') if count > 0 else []
+        self._indices: Dict[str, int] = {
+            plant: i for i, plant in enumerate(self._plants)}
+        offset += names_size
+
+        self._listed: bytes = self._mmap[offset:offset + count]
+        offset += count
+
+        self._count: int = count
+        self._scores: memoryview = memoryview(self._mmap)[
+            offset:offset + count * count].cast('b')
+
+    def close(self) -> None:
+        """ Unmap the snapshot. """
+
+        self._scores.release()
+        self._mmap.close()
+
+    def get_all_plants(self) -> List[str]:
+        """ Get all plants from the snapshot. """
+
+        return [plant for plant, listed in zip(self._plants, self._listed)
+                if listed]
+
+    def get_all_symbioses(self) -> List[Tuple[str, str, int]]:
+        """ Get every symbiosis score as (plant_a, plant_b, score). """
+
+        symbioses: List[Tuple[str, str, int]] = []
+        for a in range(self._count):
+            row: memoryview = self._scores[a * self._count:(a + 1) * self._count]
+            for b in range(a, self._count):
+                if row[b] != 0:
+                    symbioses.append((self._plants[a], self._plants[b], row[b]))
+
+        return symbioses
+
+    def get_symbiosis_score(self, plant_a: str, plant_b: str) -> int:
+        """ Get the symbiosis score of the plants a and b from the snapshot. """
+
+        a: int = self._indices.get(plant_a, -1)
+        b: int = self._indices.get(plant_b, -1)
+        if a < 0 or b < 0:
+
+            # Default 0
+            return 0
+
+        return self._scores[a * self._count + b]
+
+    def get_symbiosis_scores(
+        self, pairs: Iterable[Tuple[str, str]]) -> List[int]:
+        """ Get the symbiosis scores of many pairs of plants (plant_a, plant_b). """
+
+        return [self.get_symbiosis_score(plant_a, plant_b)
+                for plant_a, plant_b in pairs]
+
+    def get_symbiosis_submatrix(
+        self, plants: Iterable[str]) -> Tuple[Dict[str, int], List[List[int]]]:
+        """ Get the index of each plant and the matrix of their symbiosis scores. """
+
+        indices: Dict[str, int] = {}
+        for plant in plants:
+            indices.setdefault(plant, len(indices))
+
+        matrix: List[List[int]] = [
+            [self.get_symbiosis_score(plant_a, plant_b) for plant_b in indices]
+            for plant_a in indices]
+
+        return indices, matrix
+
+    def get_symbioses_version(self) -> int:
+        """ Get a number that changes whenever the symbioses change. """
+
+        # A snapshot never changes
+        return 0
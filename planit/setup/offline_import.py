@@ -0,0 +1,163 @@
+import argparse
+import json
+import logging
+import os
+import typing
+
+from planit import resources
+from planit.plant_data import sync
+
+
+# Path of the plant data dir
+basePath = 'plantdata/'
+
+# Valid symbiosis scores: avoid, neutral, helps
+VALID_SCORES = (-1, 0, 1)
+
+
+def read_plants(path: str) -> typing.Iterator[str]:
+    """ Yields the common names of plants.txt, which has one name per line and comments starting with #. """
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            common_name = line.strip()
+            if common_name and not common_name.startswith('#'):
+                yield common_name
+
+
+def _read_values(file: typing.TextIO, chunk_size: int) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+    """
+    Yields the tokens ('{', '}', ':', ',') and the JSON values of the outer object of a file. The file is
+    read in chunks and each value is decoded as soon as it is complete, so only one value is in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    end_of_file = False
+    is_outer_object_open = False
+
+    while True:
+        # Skip whitespace
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+
+        if position == len(buffer):
+            if end_of_file:
+                return
+            buffer, position = file.read(chunk_size), 0
+            end_of_file = len(buffer) == 0
+            continue
+
+        # The outer object and its separators. Inner objects are decoded as one value.
+        if buffer[position] in '}:,' or buffer[position] == '{' and not is_outer_object_open:
+            is_outer_object_open = True
+            yield buffer[position], None
+            position += 1
+            continue
+
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if end_of_file:
+                raise
+
+            # The value continues in the next chunk
+            chunk = file.read(chunk_size)
+            end_of_file = len(chunk) == 0
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+
+        # A number may continue in the next chunk
+        if end == len(buffer) and not end_of_file:
+            chunk = file.read(chunk_size)
+            end_of_file = len(chunk) == 0
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+
+        yield 'value', value
+        position = end
+
+
+def read_symbiosis_data(path: str, chunk_size: int = 64 * 1024) -> typing.Iterator[typing.Tuple[str, str, int]]:
+    """
+    Streams the symbioses (plant_a, plant_b, score) of symbiosis_data.json, which maps each plant to its
+    neighbours and their scores. Invalid names or scores raise a ValueError.
+    """
+    with open(path, encoding='utf-8') as file:
+        tokens = _read_values(file, chunk_size)
+
+        if next(tokens, (None, None))[0] != '{':
+            raise ValueError("'{}' does not contain a JSON object".format(path))
+
+        for token, plant in tokens:
+            if token == '}':
+                return
+            if token == ',':
+                continue
+            if token != 'value' or not isinstance(plant, str) or next(tokens, (None, None))[0] != ':':
+                raise ValueError("Expected the name of a plant in '{}'".format(path))
+
+            token, neighbours = next(tokens, (None, None))
+            if token != 'value' or not isinstance(neighbours, dict):
+                raise ValueError("Expected the neighbours of '{}' in '{}'".format(plant, path))
+
+            for neighbour, score in neighbours.items():
+                # bool is a subclass of int, but true is not a valid score
+                if isinstance(score, bool) or score not in VALID_SCORES:
+                    raise ValueError("Invalid score {!r} of '{}' and '{}'".format(score, plant, neighbour))
+                if not plant.strip() or not neighbour.strip():
+                    raise ValueError("Empty plant name in '{}'".format(path))
+
+                yield plant, neighbour, score
+
+        raise ValueError("Unexpected end of '{}'".format(path))
+
+
+def deduplicate_symbioses(symbioses: typing.Iterable[typing.Tuple[str, str, int]]) \
+        -> typing.List[typing.Tuple[str, str, int]]:
+    """
+    Removes the mirrored pairs, as each pair is only stored once, and the neutral scores, as they are the
+    default. If both directions of a pair have different scores, the first one wins.
+    """
+    scores_by_pair = {}
+    unique_symbioses = []
+
+    for plant_a, plant_b, score in symbioses:
+        pair = (min(plant_a, plant_b), max(plant_a, plant_b))
+        if pair in scores_by_pair:
+            if scores_by_pair[pair] != score:
+                logging.warning("Conflicting scores of '{}' and '{}', keeping {}".format(
+                    plant_a, plant_b, scores_by_pair[pair]))
+            continue
+
+        scores_by_pair[pair] = score
+        if score != 0:
+            unique_symbioses.append((plant_a, plant_b, score))
+
+    return unique_symbioses
+
+
+def import_plant_data(symbiosis_data_path: str = None, plants_path: str = None) -> typing.Tuple[int, int]:
+    """
+    Replaces the plants and symbioses in the db with the ones of plants.txt and symbiosis_data.json. Only the
+    differences are written in a single transaction. Returns the number of changed plants and symbioses.
+    """
+    if symbiosis_data_path is None:
+        symbiosis_data_path = os.path.join(resources.get(basePath), 'symbiosis_data.json')
+    if plants_path is None:
+        plants_path = os.path.join(resources.get(basePath), 'plants.txt')
+
+    # Parse everything before touching the db, so invalid files leave it unchanged
+    plants = list(read_plants(plants_path))
+    symbioses = deduplicate_symbioses(read_symbiosis_data(symbiosis_data_path))
+
+    return sync(plants, symbioses)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import the plant data without crawling it.')
+    parser.add_argument('--symbiosis-data', help='path of symbiosis_data.json')
+    parser.add_argument('--plants', help='path of plants.txt')
+    args = parser.parse_args()
+
+    plant_count, symbiosis_count = import_plant_data(args.symbiosis_data, args.plants)
+    print('Changed {} plants and {} symbioses'.format(plant_count, symbiosis_count))
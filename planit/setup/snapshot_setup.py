@@ -0,0 +1,16 @@
+from planit.plant_data.db import Db
+from planit.plant_data.snapshot import get_snapshot_path, write_snapshot
+
+
+def create_snapshot_file():
+    db = Db()
+    plants = db.get_all_plants()
+    symbioses = db.get_all_symbioses()
+
+    # Closing the db checkpoints its WAL file, so the snapshot is written last and is newer than the db
+    db.close()
+    write_snapshot(get_snapshot_path(), plants, symbioses)
+
+
+if __name__ == '__main__':
+    create_snapshot_file()
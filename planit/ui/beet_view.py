@@ -10,16 +10,15 @@ from .theme import theme
 from .widgets.scrollable_canvas import ScrollableCanvas
 from ..standard_types import *
 from ..genetic import plan_optimizer
-from .cell_quality_colors import QUALITY_COLORS
+from .cell_quality_colors import get_quality_color
+from .quality_heatmap import QualityHeatmap
+from .quality_index import QualityIndex
 
 import typing
 
 
-def get_quality_color(quality):
-    count = len(QUALITY_COLORS)
-    idx = round((quality + 1) / 2 * count)
-    idx = 0 if idx < 0 else count-1 if idx >= count else idx
-    return QUALITY_COLORS[idx]
+# Tag of canvas items that are always shown above the cells, e.g. the cursor
+OVERLAY_TAG = "overlay"
 
 
 class Cell:
@@ -36,26 +35,80 @@ class Cell:
         self.movable_pattern = None
         self.text = None
 
-    def draw(self, bbox: BBox, canvas: tk.Canvas):
-        background_color = get_quality_color(self.quality)
+    def draw(self, bbox: BBox, canvas: tk.Canvas, is_detailed=True, show_quality=True):
+        """
+        Draws the cell. Without details (when zoomed out), the cell is only a single coloured rectangle without
+        text and movable pattern. Without quality, the background is transparent (e.g. above a QualityHeatmap).
+        """
+        background_color = get_quality_color(self.quality) if show_quality else ""
         background_style = theme.beet_view.cell.background
         background_style["fill"] = background_color
         self.background = canvas.create_rectangle(*bbox, **background_style)
+        if not is_detailed:
+            canvas.itemconfig(self.background, width=0)
 
-        cx = bbox.x0 + (bbox.x1 - bbox.x0) / 2
-        cy = bbox.y0 + (bbox.y1 - bbox.y0) / 2
+        text, text_style = self._get_text(is_detailed)
+        if text is not None:
+            self.text = canvas.create_text(*self._get_center(bbox), text=text, justify=tk.CENTER, **text_style)
 
-        if self.plant is not None and not self.is_joker:
-            self.text = canvas.create_text(cx, cy, text=str(self.plant), justify=tk.CENTER,
-                                           **theme.beet_view.cell.plant_text)
+        if self.is_movable and is_detailed:
+            self.movable_pattern = canvas.create_rectangle(*self._get_movable_pattern_bbox(bbox),
+                                                           **theme.beet_view.cell.movable_pattern)
 
-        if self.is_joker:
-            self.text = canvas.create_text(cx, cy, text="?", justify=tk.CENTER,
-                                           **theme.beet_view.cell.joker_text)
+    def update(self, bbox: BBox, canvas: tk.Canvas, is_detailed=True, show_quality=True):
+        """
+        Updates the existing canvas items of the cell in place. Items are only created or deleted when they
+        appear or disappear, e.g. the text when the plant is removed.
+        """
+        if self.background is None:
+            self.draw(bbox, canvas, is_detailed, show_quality)
+            return
 
-        if self.is_movable:
-            self.movable_pattern = canvas.create_rectangle(bbox.x0 + 5, bbox.y0 - 5, bbox.x1 - 5, bbox.y1 + 5,
+        canvas.coords(self.background, *bbox)
+        canvas.itemconfig(self.background, fill=get_quality_color(self.quality) if show_quality else "",
+                          width=theme.beet_view.cell.background.get("width", 1) if is_detailed else 0)
+
+        text, text_style = self._get_text(is_detailed)
+        if text is None:
+            if self.text is not None:
+                canvas.delete(self.text)
+                self.text = None
+        elif self.text is None:
+            self.text = canvas.create_text(*self._get_center(bbox), text=text, justify=tk.CENTER, **text_style)
+        else:
+            canvas.coords(self.text, *self._get_center(bbox))
+            canvas.itemconfig(self.text, text=text, **text_style)
+
+        if not self.is_movable or not is_detailed:
+            if self.movable_pattern is not None:
+                canvas.delete(self.movable_pattern)
+                self.movable_pattern = None
+        elif self.movable_pattern is None:
+            self.movable_pattern = canvas.create_rectangle(*self._get_movable_pattern_bbox(bbox),
                                                            **theme.beet_view.cell.movable_pattern)
+        else:
+            canvas.coords(self.movable_pattern, *self._get_movable_pattern_bbox(bbox))
+
+    def _get_text(self, is_detailed=True) -> typing.Tuple[typing.Optional[str], typing.Optional[dict]]:
+        """ Returns the text that is shown in the cell and its style or (None, None). """
+        if not is_detailed:
+            return None, None
+
+        if self.is_joker:
+            return "?", theme.beet_view.cell.joker_text
+
+        if self.plant is not None:
+            return str(self.plant), theme.beet_view.cell.plant_text
+
+        return None, None
+
+    @staticmethod
+    def _get_center(bbox: BBox) -> Position:
+        return bbox.x0 + (bbox.x1 - bbox.x0) / 2, bbox.y0 + (bbox.y1 - bbox.y0) / 2
+
+    @staticmethod
+    def _get_movable_pattern_bbox(bbox: BBox) -> BBox:
+        return BBox(bbox.x0 + 5, bbox.y0 - 5, bbox.x1 - 5, bbox.y1 + 5)
 
     def clear(self, canvas: tk.Canvas):
         def safe_delete(tag):
@@ -89,27 +142,265 @@ class Cell:
 
 
 class BeetView(ScrollableCanvas):
+    """
+    Shows the cells of a plan on a canvas that can be panned and zoomed (Ctrl + mouse wheel).
+
+    Only the cells in the visible region (plus a margin) have canvas items, so that large plans stay fast. The
+    other cells are drawn when they become visible.
+    """
+
+    # Limits of the cell size (in pixels) when zooming
+    MIN_CELL_SIZE = 4
+    MAX_CELL_SIZE = 200
+
+    # Smaller cells are drawn without text and movable pattern
+    MIN_DETAILED_CELL_SIZE = 40
+
+    # Cells up to this many pixels outside of the visible region are drawn as well, so that panning doesn't
+    # reveal undrawn cells before they are drawn
+    VIEWPORT_MARGIN = 200
+
+    # Up to this many qualities are put into the heatmap pixel by pixel instead of rebuilding it
+    MAX_HEATMAP_PIXEL_UPDATES = 64
+
     def __init__(self, root):
         super(BeetView, self).__init__(root, scroll_start_event="<ButtonPress-2>", scroll_move_event="<B2-Motion>",
                                        **theme.beet_view.canvas)
 
         self.cells_by_pos: typing.Dict[Position, Cell] = {}
 
+        # Updates the qualities of the cells whenever their plants change
+        self.quality_index = QualityIndex()
+
+        # Increases with every change of the plan (cells, plants or movable flags), e.g. to notice that a plan
+        # exported before is outdated
+        self.change_count = 0
+
         self.canvas.create_oval(-10, -10, 10, 10, **theme.beet_view.center_circle)
 
         self.cell_size = 100
         self.padding = 200
 
+        # Cells whose canvas items are outdated. They are updated together once the UI is idle (see flush).
+        self._dirty_positions: typing.Set[Position] = set()
+        self._flush_id = None
+
+        # Positions of the cells that may have canvas items
+        self._drawn_positions: typing.Set[Position] = set()
+        self._viewport_update_id = None
+
+        # Optional image that shows the qualities instead of the cell backgrounds (see set_heatmap_enabled)
+        self.heatmap: typing.Optional[QualityHeatmap] = None
+        self._is_heatmap_outdated = False
+        # The heatmap has to be rendered again in the next flush, e.g. because the viewport changed
+        self._is_heatmap_render_outdated = False
+
+        # Draw the cells that become visible when scrolling
+        self.scrollbar_x.config(command=self._scroll_x)
+        self.scrollbar_y.config(command=self._scroll_y)
+
+        self.canvas.bind("<Control-MouseWheel>", self.on_zoom)
+        self.canvas.bind("<Control-Button-4>", self.on_zoom)
+        self.canvas.bind("<Control-Button-5>", self.on_zoom)
+
     # Cell methods
 
     def _draw_cell(self, cell: Cell, pos: Position):
-        """ Draws a cell on the canvas. """
-        cell.draw(self.get_cell_bbox(pos), self.canvas)
+        """ Draws a cell on the canvas in the next flush. """
+        self._mark_dirty(pos)
 
     def _redraw_cell(self, cell: Cell, pos: Position):
-        """ Clears a cell and redraws it on the canvas. """
-        cell.clear(self.canvas)
-        cell.draw(self.get_cell_bbox(pos), self.canvas)
+        """ Updates a cell on the canvas in the next flush. """
+        self._mark_dirty(pos)
+
+    def _mark_dirty(self, pos: Position):
+        self._dirty_positions.add(pos)
+        self._schedule_flush()
+
+    def _mark_heatmap_outdated(self):
+        """ Rebuilds the heatmap in the next flush, e.g. because cells were added or moved. """
+        if self.heatmap is not None:
+            self._is_heatmap_outdated = True
+            self._is_heatmap_render_outdated = True
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_id is None:
+            self._flush_id = self.canvas.after_idle(self.flush)
+
+    def flush(self):
+        """
+        Updates the canvas items of every cell that changed since the last flush in a single pass, so that
+        changing many cells (e.g. applying an optimised plan) only updates each cell once.
+        """
+        if self._flush_id is not None:
+            self.canvas.after_cancel(self._flush_id)
+            self._flush_id = None
+
+        visible_cell_range = x0, y0, x1, y1 = self.get_visible_cell_range()
+        is_detailed = self.is_detailed
+        show_quality = self.heatmap is None
+        are_cells_drawn = self._are_cells_drawn()
+
+        for pos in self._dirty_positions:
+            cell = self.cells_by_pos.get(pos, None)
+            if cell is None:
+                self._drawn_positions.discard(pos)
+            elif are_cells_drawn and x0 <= pos[0] <= x1 and y0 <= pos[1] <= y1:
+                cell.update(self.get_cell_bbox(pos), self.canvas, is_detailed, show_quality)
+                self._drawn_positions.add(pos)
+            else:
+                # Cells outside of the viewport are drawn when they become visible
+                cell.clear(self.canvas)
+                self._drawn_positions.discard(pos)
+
+        self._dirty_positions.clear()
+
+        if self.heatmap is not None and self._is_heatmap_render_outdated:
+            if self._is_heatmap_outdated:
+                self.heatmap.set_qualities({pos: cell.quality for pos, cell in self.cells_by_pos.items()})
+                self._is_heatmap_outdated = False
+
+            self.heatmap.render(visible_cell_range, int(self.cell_size))
+            self.canvas.tag_lower(self.heatmap.item)
+            self._is_heatmap_render_outdated = False
+
+        # Keep overlays like the cursor above cells that were drawn in this flush
+        self.canvas.tag_raise(OVERLAY_TAG)
+
+    def on_resize(self, event=None):
+        self._update_scroll_region()
+        self.update_viewport()
+
+    def _update_scroll_region(self):
+        """ Sets the scroll region to the extent of every cell, including the cells that are not drawn. """
+        # Always include the center circle
+        x0, y0, x1, y1 = -10, -10, 10, 10
+
+        if len(self.cells_by_pos) > 0:
+            min_x = min(x for (x, y) in self.cells_by_pos)
+            max_x = max(x for (x, y) in self.cells_by_pos)
+            min_y = min(y for (x, y) in self.cells_by_pos)
+            max_y = max(y for (x, y) in self.cells_by_pos)
+
+            # The y axis of the canvas points down
+            x0, y0 = min(x0, min_x * self.cell_size), min(y0, -(max_y + 1) * self.cell_size)
+            x1, y1 = max(x1, (max_x + 1) * self.cell_size), max(y1, -min_y * self.cell_size)
+
+        p = self.padding
+        self.canvas.config(scrollregion=(x0 - p, y0 - p, x1 + p, y1 + p))
+
+    # Viewport methods
+
+    def _are_cells_drawn(self) -> bool:
+        """ Zoomed out cells above the heatmap would be invisible anyway, so they aren't drawn at all. """
+        return self.heatmap is None or self.is_detailed
+
+    def set_heatmap_enabled(self, is_enabled: bool):
+        """
+        Switches between showing the quality of each cell as the colour of its background and as a
+        QualityHeatmap. The heatmap is a lot cheaper to update on large plans.
+        """
+        if is_enabled == (self.heatmap is not None):
+            return
+
+        if is_enabled:
+            self.heatmap = QualityHeatmap(self.canvas)
+            self._is_heatmap_outdated = True
+            self._is_heatmap_render_outdated = True
+        else:
+            self.heatmap.destroy()
+            self.heatmap = None
+
+        # The backgrounds change and cells may appear or disappear
+        self._dirty_positions.update(self._drawn_positions)
+        self.update_viewport()
+
+    @property
+    def is_detailed(self) -> bool:
+        """ Whether the cells are large enough to show their text and movable pattern. """
+        return self.cell_size >= self.MIN_DETAILED_CELL_SIZE
+
+    def get_visible_cell_range(self) -> typing.Tuple[int, int, int, int]:
+        """ Returns the (x0, y0, x1, y1) cell positions (inclusive) of the visible region including the margin. """
+        m = self.VIEWPORT_MARGIN
+        left, top = self.canvas.canvasx(0) - m, self.canvas.canvasy(0) - m
+        right = self.canvas.canvasx(self.canvas.winfo_width()) + m
+        bottom = self.canvas.canvasy(self.canvas.winfo_height()) + m
+
+        x0, y1 = self.xy_to_cell_pos(left, top)
+        x1, y0 = self.xy_to_cell_pos(right, bottom)
+        return x0, y0, x1, y1
+
+    def update_viewport(self):
+        """ Clears the cells that left the visible region and draws the ones that entered it. """
+        if self._viewport_update_id is not None:
+            self.canvas.after_cancel(self._viewport_update_id)
+            self._viewport_update_id = None
+
+        x0, y0, x1, y1 = self.get_visible_cell_range()
+
+        for pos in self._drawn_positions:
+            if not (x0 <= pos[0] <= x1 and y0 <= pos[1] <= y1):
+                self._dirty_positions.add(pos)
+
+        # Either look up every visible position or check every cell, whichever is less work
+        if (x1 - x0 + 1) * (y1 - y0 + 1) < len(self.cells_by_pos):
+            visible_positions = (
+                (x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) if (x, y) in self.cells_by_pos)
+        else:
+            visible_positions = (
+                pos for pos in self.cells_by_pos if x0 <= pos[0] <= x1 and y0 <= pos[1] <= y1)
+
+        if self._are_cells_drawn():
+            for pos in visible_positions:
+                if pos not in self._drawn_positions:
+                    self._dirty_positions.add(pos)
+
+        self._is_heatmap_render_outdated = True
+        self.flush()
+
+    def _schedule_viewport_update(self):
+        """ Updates the viewport once the UI is idle, so that many scroll events only update it once. """
+        if self._viewport_update_id is None:
+            self._viewport_update_id = self.canvas.after_idle(self.update_viewport)
+
+    def _scroll_x(self, *args):
+        self.canvas.xview(*args)
+        self._schedule_viewport_update()
+
+    def _scroll_y(self, *args):
+        self.canvas.yview(*args)
+        self._schedule_viewport_update()
+
+    def on_scroll_move(self, event):
+        super(BeetView, self).on_scroll_move(event)
+        self._schedule_viewport_update()
+
+    def on_zoom(self, event):
+        if event.num == 5 or event.delta < 0:
+            self.zoom(1 / 1.25, event.x, event.y)
+        else:
+            self.zoom(1.25, event.x, event.y)
+
+    def zoom(self, factor: float, x: int = 0, y: int = 0):
+        """ Scales the cells by the factor while the point at the screen position (x, y) stays in place. """
+        # Whole pixels, so that the heatmap can be scaled to the cell size
+        cell_size = min(max(round(self.cell_size * factor), self.MIN_CELL_SIZE), self.MAX_CELL_SIZE)
+        factor = cell_size / self.cell_size
+        if factor == 1:
+            return
+
+        canvas_x, canvas_y = self.canvas.canvasx(x), self.canvas.canvasy(y)
+        self.cell_size = cell_size
+
+        # Every drawn cell moves
+        self._dirty_positions.update(self._drawn_positions)
+
+        self._update_scroll_region()
+        self.canvas.scan_mark(0, 0)
+        self.canvas.scan_dragto(round(canvas_x - canvas_x * factor), round(canvas_y - canvas_y * factor), gain=1)
+        self.update_viewport()
 
     def add_empty_cell(self, pos: Position, resize=True):
         """ Adds an empty cell to the plan and draws it. """
@@ -119,6 +410,9 @@ class BeetView(ScrollableCanvas):
         cell = Cell()
         self._draw_cell(cell, pos)
         self.cells_by_pos[pos] = cell
+        self.change_count += 1
+        self._mark_heatmap_outdated()
+        self.set_qualities(self.quality_index.set_plant(pos, None))
 
         if resize:
             self.on_resize(None)
@@ -130,6 +424,10 @@ class BeetView(ScrollableCanvas):
 
         self.cells_by_pos[pos].clear(self.canvas)
         del self.cells_by_pos[pos]
+        self._drawn_positions.discard(pos)
+        self.change_count += 1
+        self._mark_heatmap_outdated()
+        self.set_qualities(self.quality_index.remove(pos))
 
         if resize:
             self.on_resize(None)
@@ -141,6 +439,7 @@ class BeetView(ScrollableCanvas):
 
         cell_a = self.cells_by_pos.get(pos_a, None)
         cell_b = self.cells_by_pos.get(pos_b, None)
+        self.change_count += 1
 
         # When swapping with an empty cell, the empty cell is a None and therefore won't overwrite
         # the other cell's origin location => Overwrite (delete) it here for the None cell
@@ -157,6 +456,13 @@ class BeetView(ScrollableCanvas):
             self.cells_by_pos[pos_a] = cell_b
             self._redraw_cell(cell_b, pos_a)
 
+        # Moving a cell into an empty position clears its pixel and may change the bounds of the heatmap.
+        # Otherwise, the changed qualities below are enough to update it.
+        if cell_a is None or cell_b is None:
+            self._mark_heatmap_outdated()
+
+        self.set_qualities(self.quality_index.swap(pos_a, pos_b))
+
     def get_cell(self, pos: Position) -> Cell:
         return self.cells_by_pos[pos]
 
@@ -169,6 +475,11 @@ class BeetView(ScrollableCanvas):
             cell.clear(self.canvas)
 
         self.cells_by_pos.clear()
+        self._dirty_positions.clear()
+        self.change_count += 1
+        self._drawn_positions.clear()
+        self._mark_heatmap_outdated()
+        self.quality_index.reset({})
 
     # Cell coordinate helper methods
 
@@ -205,9 +516,30 @@ class BeetView(ScrollableCanvas):
             return
 
         cell.plant = plant
+        self.change_count += 1
         if redraw:
             self._redraw_cell(cell, pos)
 
+        for quality_pos, quality in self.quality_index.set_plant(pos, plant).items():
+            self.set_quality(quality_pos, quality, redraw)
+
+    def set_plants(self, plants_by_pos: typing.Dict[Position, Plant]):
+        """
+        Sets the plants of many cells at once, e.g. of an optimised plan, and updates the qualities together.
+        """
+        qualities = {}
+        self.change_count += 1
+        for pos, plant in plants_by_pos.items():
+            cell = self.cells_by_pos.get(pos, None)
+            if cell is None:
+                continue
+
+            cell.plant = plant
+            self._redraw_cell(cell, pos)
+            qualities.update(self.quality_index.set_plant(pos, plant))
+
+        self.set_qualities(qualities)
+
     def set_joker(self, pos: Position, is_joker: bool, redraw=True):
         """
         Sets the joker flag of the cell at the given cell position if there is a cell there.
@@ -229,6 +561,7 @@ class BeetView(ScrollableCanvas):
             return
 
         cell.is_movable = is_movable
+        self.change_count += 1
         if redraw:
             self._redraw_cell(cell, pos)
 
@@ -241,8 +574,34 @@ class BeetView(ScrollableCanvas):
             return
 
         cell.quality = quality
-        if redraw:
+        if not redraw:
+            return
+
+        # The heatmap updates the shown pixels itself, so it doesn't need a flush
+        if self.heatmap is None:
             self._redraw_cell(cell, pos)
+        elif not self.heatmap.set_quality(pos, quality):
+            self._mark_heatmap_outdated()
+
+    def set_qualities(self, qualities_by_pos: typing.Dict[Position, float]):
+        """
+        Sets the quality attribute of many cells at once. With the heatmap, this is a single image update.
+        """
+        if len(qualities_by_pos) <= self.MAX_HEATMAP_PIXEL_UPDATES:
+            for pos, quality in qualities_by_pos.items():
+                self.set_quality(pos, quality)
+            return
+
+        for pos, quality in qualities_by_pos.items():
+            cell = self.cells_by_pos.get(pos, None)
+            if cell is None:
+                continue
+
+            cell.quality = quality
+            if self.heatmap is None:
+                self._redraw_cell(cell, pos)
+
+        self._mark_heatmap_outdated()
 
     # Save / load
 
@@ -267,6 +626,9 @@ class BeetView(ScrollableCanvas):
             self._draw_cell(cell, pos)
             self.cells_by_pos[pos] = cell
 
+        self._mark_heatmap_outdated()
+        self.set_qualities(self.quality_index.reset({pos: cell.plant for pos, cell in self.cells_by_pos.items()}))
+
     def export_plan(self):
         """
         Converts the BeetView to a plan_optimizer.Plan that can be optimised.
@@ -276,15 +638,3 @@ class BeetView(ScrollableCanvas):
 
         plan = plan_optimizer.Plan(plants_by_pos, movable_positions)
         return plan
-
-    def export_partial_plan(self, positions_to_include, include_movable=True):
-        """
-        Creates a plan_optimizer.Plan object that only includes the target cells
-        """
-        plants_by_pos = {pos: self.cells_by_pos.get(pos, Cell()).plant for pos in positions_to_include}
-        if include_movable:
-            movable_positions = [pos for pos in positions_to_include if self.cells_by_pos.get(pos, Cell()).is_movable]
-        else:
-            movable_positions = []
-        plan = plan_optimizer.Plan(plants_by_pos, movable_positions)
-        return plan
@@ -70,3 +70,10 @@ QUALITY_COLORS = [
     for color
     in create_gradient(quality_settings.gradient, steps_per_color=quality_settings.gradient_smoothing)
 ]
+
+
+def get_quality_color(quality):
+    count = len(QUALITY_COLORS)
+    idx = round((quality + 1) / 2 * count)
+    idx = 0 if idx < 0 else count-1 if idx >= count else idx
+    return QUALITY_COLORS[idx]
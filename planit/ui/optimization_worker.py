@@ -0,0 +1,64 @@
+"""
+Runs the optimisation in a background thread, so that the UI stays responsive.
+"""
+
+import queue
+import threading
+import typing
+
+from ..genetic import plan_optimizer
+from ..genetic.plan_optimizer import Plan
+
+
+class OptimizationWorker:
+    """
+    Runs plan_optimizer.optimize in a background thread.
+
+    The worker posts messages to a queue that the UI polls (see poll): ("progress", best plan so far) whenever
+    the best plan improved, and finally ("done", best plan) or ("error", exception).
+    """
+
+    def __init__(self, plan: Plan, **optimize_params):
+        self.plan = plan
+        self.optimize_params = optimize_params
+
+        self.messages: "queue.Queue[typing.Tuple[str, typing.Any]]" = queue.Queue()
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="optimization", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        """ Stops the optimisation after the current generation. It still posts the best plan so far. """
+        self._cancel_event.set()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread.is_alive()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def _on_progress(self, best_plan: typing.Optional[Plan]) -> bool:
+        if best_plan is not None:
+            self.messages.put(("progress", best_plan))
+
+        return self._cancel_event.is_set()
+
+    def _run(self):
+        try:
+            best_plan = plan_optimizer.optimize(self.plan, **self.optimize_params, callback=self._on_progress)
+            self.messages.put(("done", best_plan))
+        except Exception as e:
+            self.messages.put(("error", e))
+
+    def poll(self) -> typing.List[typing.Tuple[str, typing.Any]]:
+        """ Returns the messages that were posted since the last call without blocking. """
+        messages = []
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                return messages
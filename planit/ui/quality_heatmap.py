@@ -0,0 +1,124 @@
+"""
+An image that shows the quality of every cell, which is a lot cheaper to update than one canvas item per cell.
+"""
+
+import tkinter as tk
+import typing
+
+from .cell_quality_colors import get_quality_color
+from ..standard_types import *
+
+
+class QualityHeatmap:
+    """
+    Stores the quality colour of every cell as one pixel of an image and shows it on the canvas, scaled to the
+    cell size.
+
+    All qualities are written with bulk `put`s of whole rows. Only the visible part of the image is scaled
+    (see render), so that the scaled image stays small when zoomed in on a large plan.
+    """
+
+    def __init__(self, canvas: tk.Canvas):
+        self.canvas = canvas
+
+        # One pixel per cell. Pixel (0, 0) is the cell (min_x, max_y), as the y axis of the canvas points down.
+        self._image = tk.PhotoImage(master=canvas)
+        self._scaled_image = tk.PhotoImage(master=canvas)
+        self.item = canvas.create_image(0, 0, image=self._scaled_image, anchor=tk.NW)
+
+        self._min_x = 0
+        self._max_y = 0
+        self._width = 0
+        self._height = 0
+
+        # (column0, row0, column1, row1, cell_size) of the part of the image that the scaled image shows
+        self._rendered_range: typing.Optional[typing.Tuple[int, int, int, int, int]] = None
+
+    def set_qualities(self, qualities_by_pos: typing.Dict[Position, float]):
+        """
+        Replaces the image with the qualities of every cell. Pixels without a cell stay transparent. The new image
+        is shown after the next render.
+        """
+        self._image.blank()
+        self._rendered_range = None
+        if len(qualities_by_pos) == 0:
+            self._width = self._height = 0
+            return
+
+        self._min_x = min(x for (x, y) in qualities_by_pos)
+        self._max_y = max(y for (x, y) in qualities_by_pos)
+        self._width = max(x for (x, y) in qualities_by_pos) - self._min_x + 1
+        self._height = self._max_y - min(y for (x, y) in qualities_by_pos) + 1
+        self._image.configure(width=self._width, height=self._height)
+
+        # (column, colour) of each row of the image
+        rows: typing.Dict[int, typing.List[typing.Tuple[int, str]]] = {}
+        for (x, y), quality in qualities_by_pos.items():
+            rows.setdefault(self._max_y - y, []).append((x - self._min_x, get_quality_color(quality)))
+
+        # A rectangular plan is written at once, otherwise each run of adjacent cells in a row
+        if len(qualities_by_pos) == self._width * self._height:
+            self._image.put(" ".join(
+                "{" + " ".join(color for _, color in sorted(rows[row])) + "}" for row in range(self._height)))
+            return
+
+        for row, pixels in rows.items():
+            pixels.sort()
+            run_start = 0
+            for i in range(1, len(pixels) + 1):
+                if i == len(pixels) or pixels[i][0] != pixels[i - 1][0] + 1:
+                    colors = " ".join(color for _, color in pixels[run_start:i])
+                    self._image.put("{" + colors + "}", to=(pixels[run_start][0], row))
+                    run_start = i
+
+    def set_quality(self, pos: Position, quality: float) -> bool:
+        """
+        Changes the quality of a single cell. Returns False if the cell is outside of the image, which then has
+        to be rebuilt with set_qualities.
+        """
+        column, row = pos[0] - self._min_x, self._max_y - pos[1]
+        if not (0 <= column < self._width and 0 <= row < self._height):
+            return False
+
+        color = get_quality_color(quality)
+        self._image.put(color, to=(column, row))
+
+        # Fill the cell in the scaled image as well, so that it doesn't have to be rendered again
+        if self._rendered_range is not None:
+            column0, row0, column1, row1, cell_size = self._rendered_range
+            if column0 <= column < column1 and row0 <= row < row1:
+                x, y = (column - column0) * cell_size, (row - row0) * cell_size
+                self._scaled_image.put(color, to=(x, y, x + cell_size, y + cell_size))
+
+        return True
+
+    def render(self, visible_cell_range: typing.Tuple[int, int, int, int], cell_size: int):
+        """
+        Scales the part of the image in the visible cell range (x0, y0, x1, y1) to the cell size. Nothing happens
+        if that part is already shown.
+        """
+        x0, y0, x1, y1 = visible_cell_range
+        column0, column1 = max(x0 - self._min_x, 0), min(x1 - self._min_x + 1, self._width)
+        row0, row1 = max(self._max_y - y1, 0), min(self._max_y - y0 + 1, self._height)
+
+        rendered_range = (column0, row0, column1, row1, cell_size)
+        if rendered_range == self._rendered_range:
+            return
+        self._rendered_range = rendered_range
+
+        self._scaled_image.blank()
+        if column0 >= column1 or row0 >= row1:
+            self._scaled_image.configure(width=1, height=1)
+            return
+
+        self._scaled_image.configure(width=(column1 - column0) * cell_size, height=(row1 - row0) * cell_size)
+        self._scaled_image.tk.call(
+            self._scaled_image.name, "copy", self._image.name,
+            "-from", column0, row0, column1, row1,
+            "-zoom", cell_size, cell_size)
+
+        self.canvas.coords(
+            self.item, (self._min_x + column0) * cell_size, -(self._max_y - row0 + 1) * cell_size)
+
+    def destroy(self):
+        self.canvas.delete(self.item)
@@ -0,0 +1,151 @@
+"""
+Keeps the quality of every cell up to date while the plan is edited, without evaluating it again.
+"""
+
+import typing
+
+from ..genetic import plan_optimizer
+from ..genetic.symbiosis_matrix import SymbiosisMatrix, EMPTY_ID
+from ..standard_types import *
+
+
+class QualityIndex:
+    """
+    Stores the unnormalised score of every cell, i.e. the sum of its weighted symbiosis scores with its neighbours,
+    and the sum of all of them. The qualities are the same as the ones of `evaluator.evaluate_cell`.
+
+    As the scores are symmetric, changing the plant of a cell changes its own score by exactly as much as the scores
+    of its neighbours change together. So each change is a delta update of at most 8 neighbours, that neither
+    creates a Plan nor queries plant_data.
+    """
+
+    def __init__(self, evaluator: plan_optimizer.MatrixSymbiosisEvaluator = plan_optimizer.MAIN_EVALUATOR):
+        self.evaluator = evaluator
+
+        self.plants_by_pos: typing.Dict[Position, Plant] = {}
+        self.ids_by_pos: typing.Dict[Position, int] = {}
+        self.scores_by_pos: typing.Dict[Position, float] = {}
+        self.total_score = 0
+        self.non_empty_count = 0
+
+        # The matrix that the ids belong to
+        self._matrix: typing.Optional[SymbiosisMatrix] = None
+        self._weighted_scores: typing.List[typing.List[int]] = []
+
+        self._normalisation = len(plan_optimizer.AFFECTED_TILES) * max(
+            evaluator.negative_weight, evaluator.positive_weight)
+
+    def _is_outdated(self) -> bool:
+        """ Returns true when the evaluator switched to a new matrix, e.g. because the plant database changed. """
+        return self.evaluator.matrix is not self._matrix
+
+    def rebuild(self) -> typing.Dict[Position, float]:
+        """ Computes the score of every cell from scratch. Returns the quality of every cell. """
+        self._matrix, self._weighted_scores = self.evaluator.get_weighted_matrix()
+
+        get_id = self._matrix.get_id
+        self.ids_by_pos = {pos: get_id(plant) for pos, plant in self.plants_by_pos.items()}
+        self.scores_by_pos = {pos: 0 for pos in self.plants_by_pos}
+        self.total_score = 0
+        self.non_empty_count = sum(1 for plant in self.plants_by_pos.values() if plant is not None)
+
+        for pos, plant_id in self.ids_by_pos.items():
+            if plant_id == EMPTY_ID:
+                continue
+
+            row = self._weighted_scores[plant_id]
+            score = 0
+            for (dx, dy, weight) in plan_optimizer.AFFECTED_TILES:
+                neighbour_id = self.ids_by_pos.get((pos[0] + dx, pos[1] + dy), EMPTY_ID)
+                score += row[neighbour_id] * weight
+
+            self.scores_by_pos[pos] = score
+            self.total_score += score
+
+        return self.get_qualities()
+
+    def reset(self, plants_by_pos: typing.Dict[Position, Plant]) -> typing.Dict[Position, float]:
+        """ Replaces every cell. Returns the quality of every cell. """
+        self.plants_by_pos = dict(plants_by_pos)
+        return self.rebuild()
+
+    def set_plant(self, pos: Position, plant: Plant) -> typing.Dict[Position, float]:
+        """
+        Adds the cell if necessary and changes its plant. Returns the new qualities of the cells that changed,
+        which are the cell and its neighbours, or every cell if the index had to be rebuilt.
+        """
+        if pos in self.plants_by_pos and self.plants_by_pos[pos] is not None:
+            self.non_empty_count -= 1
+        if plant is not None:
+            self.non_empty_count += 1
+        self.plants_by_pos[pos] = plant
+
+        if self._is_outdated():
+            return self.rebuild()
+
+        old_id = self.ids_by_pos.get(pos, EMPTY_ID)
+        new_id = self._matrix.get_id(plant)
+        self.ids_by_pos[pos] = new_id
+        self.scores_by_pos.setdefault(pos, 0)
+
+        changed_positions = [pos]
+        old_row = self._weighted_scores[old_id]
+        new_row = self._weighted_scores[new_id]
+
+        for (dx, dy, weight) in plan_optimizer.AFFECTED_TILES:
+            neighbour_pos = (pos[0] + dx, pos[1] + dy)
+            neighbour_id = self.ids_by_pos.get(neighbour_pos, EMPTY_ID)
+            if neighbour_id == EMPTY_ID:
+                continue
+
+            # The cell scores with the neighbour, and the neighbour scores with the cell
+            delta = (new_row[neighbour_id] - old_row[neighbour_id]) * weight
+            self.scores_by_pos[pos] += delta
+            self.scores_by_pos[neighbour_pos] += delta
+            self.total_score += 2 * delta
+            changed_positions.append(neighbour_pos)
+
+        return {pos: self.get_quality(pos) for pos in changed_positions}
+
+    def remove(self, pos: Position) -> typing.Dict[Position, float]:
+        """ Removes a cell. Returns the new qualities of its neighbours like set_plant. """
+        if pos not in self.plants_by_pos:
+            return {}
+
+        qualities = self.set_plant(pos, None)
+        del self.plants_by_pos[pos]
+        del self.ids_by_pos[pos]
+        del self.scores_by_pos[pos]
+        qualities.pop(pos, None)
+        return qualities
+
+    def swap(self, pos_a: Position, pos_b: Position) -> typing.Dict[Position, float]:
+        """
+        Swaps two cells like BeetView.swap_cells. If only one of them exists, it moves to the other position.
+        Returns the new qualities like set_plant.
+        """
+        cells = [(pos, pos in self.plants_by_pos, self.plants_by_pos.get(pos, None)) for pos in (pos_a, pos_b)]
+
+        qualities = {}
+        for (pos, _, _), (_, other_exists, other_plant) in zip(cells, reversed(cells)):
+            if other_exists:
+                qualities.update(self.set_plant(pos, other_plant))
+            else:
+                qualities.update(self.remove(pos))
+
+        # A cell that moved away may be a neighbour of the other position
+        return {pos: quality for pos, quality in qualities.items() if pos in self.plants_by_pos}
+
+    def get_quality(self, pos: Position) -> float:
+        """ Returns the quality of a cell like `evaluator.evaluate_cell`. """
+        return self.scores_by_pos.get(pos, 0) / self._normalisation
+
+    def get_qualities(self) -> typing.Dict[Position, float]:
+        return {pos: score / self._normalisation for pos, score in self.scores_by_pos.items()}
+
+    def get_fitness(self) -> float:
+        """ Returns the fitness of the entire plan like `evaluator.evaluate`. """
+        if self.non_empty_count == 0:
+            return 0
+
+        return self.total_score / (self.non_empty_count * self._normalisation)
@@ -2,11 +2,12 @@
 import tkinter as tk
 
 from .plant_search import PlantSearchFrame
-from .beet_view import BeetView
+from .beet_view import BeetView, OVERLAY_TAG
+from .optimization_worker import OptimizationWorker
 from .widgets.toolbar import Toolbar
 from .theme import theme
 
-from ..genetic import plan_optimizer
+from ..genetic.result_cache import ResultCache
 from ..standard_types import *
 
 
@@ -64,7 +65,7 @@ class SwapTool (Tool):
     def on_lmb_press(self, event):
         self.from_pos = self.beet_view.screen_xy_to_cell_pos(event.x, event.y)
         self.from_cursor = self.beet_view.canvas.create_rectangle(
-            *self.beet_view.get_cell_bbox(self.from_pos), **theme.tools.swap_cursor)
+            *self.beet_view.get_cell_bbox(self.from_pos), tags=OVERLAY_TAG, **theme.tools.swap_cursor)
 
     def on_lmb_release(self, event):
         self.beet_view.canvas.delete(self.from_cursor)
@@ -72,8 +73,6 @@ class SwapTool (Tool):
 
         to_pos = self.beet_view.screen_xy_to_cell_pos(event.x, event.y)
         self.beet_view.swap_cells(self.from_pos, to_pos)
-        self.app.update_cell_quality(self.from_pos)
-        self.app.update_cell_quality(to_pos)
 
 
 class BrushTool (Tool):
@@ -112,17 +111,14 @@ class AddCellTool (BrushTool):
 
     def _rmb_cell_action(self, pos: Position):
         self.beet_view.delete_cell(pos, False)
-        self.app.update_cell_quality(pos)
 
 
 class MarkAsJokerTool (BrushTool):
     def _lmb_cell_action(self, pos: Position):
         self.beet_view.set_joker(pos, True)
-        self.app.update_cell_quality(pos)
 
     def _rmb_cell_action(self, pos: Position):
         self.beet_view.set_joker(pos, False)
-        self.app.update_cell_quality(pos)
 
 
 class MarkAsMovableTool (BrushTool):
@@ -139,11 +135,9 @@ class DrawPlantTool (BrushTool):
         if not plant:
             return
         self.beet_view.set_plant(pos, plant)
-        self.app.update_cell_quality(pos)
 
     def _rmb_cell_action(self, pos: Position):
         self.beet_view.set_plant(pos, None)
-        self.app.update_cell_quality(pos)
 
 
 class Tools:
@@ -163,6 +157,10 @@ class Tools:
 
 
 class App:
+    # How often (in milliseconds) the progress of a running optimisation is polled, which is about 60 times a
+    # second
+    OPTIMIZATION_POLL_INTERVAL = 16
+
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("Planit")
@@ -179,7 +177,7 @@ class App:
         beet.pack(expand=True, fill=tk.BOTH)
         self.beet = beet
 
-        self.cursor = beet.canvas.create_rectangle(0, 0, 0, 0, **theme.beet_view.cursor)
+        self.cursor = beet.canvas.create_rectangle(0, 0, 0, 0, tags=OVERLAY_TAG, **theme.beet_view.cursor)
 
         beet.canvas.bind("<Motion>", self.move_cursor_in_beet)
 
@@ -206,7 +204,16 @@ class App:
         add_tool(Tools.MARK_AS_MOVABLE, "Movable", MarkAsMovableTool(self))
         add_tool(Tools.MARK_AS_JOKER, "Joker", MarkAsJokerTool(self))
 
-        self.toolbar.add_action("Optimise", self.optimize_input)
+        self.optimize_button = self.toolbar.add_action("Optimise", self.optimize_input)
+        self.cancel_button = self.toolbar.add_action("Cancel", self.cancel_optimization)
+        self.cancel_button.config(state=tk.DISABLED)
+        self.heatmap_button = self.toolbar.add_action("Heatmap", self.toggle_heatmap)
+        self.optimization_worker: typing.Optional[OptimizationWorker] = None
+        # BeetView.change_count of the plan that is being optimised
+        self.optimized_change_count = 0
+
+        # Results of previous optimisations, so that optimising the same plan again is instant
+        self.result_cache = ResultCache()
 
     def on_change_tool(self, from_name, to_name):
         previous_tool = self.tools_by_name.get(from_name, None)
@@ -229,53 +236,11 @@ class App:
 
         return call_method_on_event
 
-    def update_cell_quality(self, pos):
-        """
-        Only updates the quality field of the affected cell and its neighbours instead of the entire plan.
-        """
-
-        # As the partial updater has to (normally) update a total 5x5 square around the affected cell, it is more
-        # efficient to just update the entire plan when less cells are involved.
-        if len(self.beet.cells_by_pos) < 25:
-            self.update_full_plan_quality()
-            return
-
-        def add_pos(pos_a, pos_b):
-            return pos_a[0] + pos_b[0], pos_a[1] + pos_b[1]
-
-        # Create a set of every cell that needs to be taken into consideration in order to evaluate the score
-        # for each plant that is directly affected by an update.
-        tiles_to_include = {
-            add_pos(pos, add_pos(start, relative_pos))
-            for relative_pos in plan_optimizer.AFFECTED_TILES
-            # The partial plan also has to include the neighbouring cells of each neighbour of the actual
-            # cell to update.
-            for start in [(0, 0), *plan_optimizer.AFFECTED_TILES]
-        }
-        tiles_to_include.add(pos)
-        plan = self.beet.export_partial_plan(tiles_to_include, include_movable=False)
-
-        # List of plants that were directly affected by the change and need to be updated.
-        positions_to_update = [
-            add_pos(pos, relative_pos)
-            for relative_pos in plan_optimizer.AFFECTED_TILES
-        ]
-        positions_to_update.append(pos)
-
-        evaluator = plan_optimizer.MAIN_EVALUATOR
-        for pos in positions_to_update:
-            self.beet.set_quality(pos, evaluator.evaluate_cell(plan, pos))
-
-    def update_full_plan_quality(self, plan=None):
-        """
-        Updates the quality field of every cell in the plan
-        """
-        if plan is None:
-            plan = self.beet.export_plan()
-
-        evaluator = plan_optimizer.MAIN_EVALUATOR
-        for pos in plan.plants_by_pos:
-            self.beet.set_quality(pos, evaluator.evaluate_cell(plan, pos))
+    def toggle_heatmap(self):
+        """ Switches between colouring each cell by its quality and showing the qualities as a single image. """
+        is_enabled = self.beet.heatmap is None
+        self.beet.set_heatmap_enabled(is_enabled)
+        self.heatmap_button.config(relief=tk.SUNKEN if is_enabled else tk.RAISED)
 
     def move_cursor_in_beet(self, event):
         """ Moves the square cursor that indicates which cell is currently under the mouse. """
@@ -284,20 +249,66 @@ class App:
             *self.beet.get_cell_bbox(self.beet.screen_xy_to_cell_pos(event.x, event.y)))
 
     def optimize_input(self):
-        # Create the inputs for the optimizer
+        # Only one optimisation can run at a time
+        if self.optimization_worker is not None and self.optimization_worker.is_running:
+            return
+
+        # Create the inputs for the optimizer. Its results only apply as long as the plan isn't edited.
         plan = self.beet.export_plan()
+        self.optimized_change_count = self.beet.change_count
+
+        # Optimize in the background and show the progress while the UI stays responsive. Half of the offspring
+        # are mutated copies, whose fitness is updated incrementally instead of evaluating the whole plan.
+        self.optimization_worker = OptimizationWorker(
+            plan, iterations=500, max_stall_generations=100, crossover_chance=0.5, cache=self.result_cache)
+        self.optimization_worker.start()
+
+        self.optimize_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.root.after(self.OPTIMIZATION_POLL_INTERVAL, self.poll_optimization)
+
+    def cancel_optimization(self):
+        """ Stops the running optimisation early and keeps the best plan so far. """
+        if self.optimization_worker is not None:
+            self.optimization_worker.cancel()
+
+    def poll_optimization(self):
+        """ Shows the latest plan that the optimisation worker posted and polls again until it is done. """
+        latest_plan = None
+        is_done = False
+
+        # Showing the results of a plan that the user edited in the meantime would undo the edits
+        is_outdated = self.beet.change_count != self.optimized_change_count
+        if is_outdated:
+            self.optimization_worker.cancel()
+
+        for message, value in self.optimization_worker.poll():
+            if message == "error":
+                print("Optimisation failed:", repr(value))
+                is_done = True
+            else:
+                # Intermediate plans that were already replaced by a better one don't have to be shown
+                latest_plan = value
+                is_done = is_done or message == "done"
+
+        if latest_plan is not None and not is_outdated:
+            self.show_plan(latest_plan)
+            self.optimized_change_count = self.beet.change_count
+
+        if not is_done:
+            self.root.after(self.OPTIMIZATION_POLL_INTERVAL, self.poll_optimization)
+            return
 
-        # Optimize
-        plan = plan_optimizer.optimize(plan, 500)
-        print(plan.fitness)
-        print(plan)
+        if latest_plan is not None and not is_outdated:
+            print(latest_plan.fitness)
+            print(latest_plan)
 
-        # Show the optimized version on screen
-        for pos, plant in plan.plants_by_pos.items():
-            self.beet.set_plant(pos, plant)
+        self.optimize_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
 
-        # Visualize the quality score of each cell
-        self.update_full_plan_quality(plan)
+    def show_plan(self, plan):
+        # Show the optimized version on screen. The qualities of the cells are updated with the plants.
+        self.beet.set_plants(plan.plants_by_pos)
 
 
 def run_app():
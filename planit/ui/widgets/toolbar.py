@@ -84,14 +84,15 @@ class Toolbar (tk.Frame, SegmentedControl[str]):
         if len(self.buttons_by_name) == 1:
             self.select(name)
 
-    def add_action(self, text: str, action: typing.Callable[[], None]):
+    def add_action(self, text: str, action: typing.Callable[[], None]) -> tk.Button:
         """
         Actions are buttons that appear on the right hand side of the toolbar and can
-        only be clicked, not permanently selected.
+        only be clicked, not permanently selected. Returns the button, e.g. to disable it.
         """
         button = tk.Button(self, text=text, command=action,
                            **{**theme.toolbar.button, **theme.toolbar.action_button})
         button.pack(side=tk.RIGHT, ipadx=5, ipady=2, padx=(0, 10), pady=5)
+        return button
 
     def add_spacer(self):
         spacer = tk.Label(self, width=2, **theme.toolbar.spacer)